@@ -3,6 +3,7 @@ from abc import ABC, abstractmethod
 import argparse
 import os
 from .config import add_common_config
+from ..utilities.metagraph_cache import MetagraphCache
 from typing import Callable
 
 
@@ -35,7 +36,12 @@ class BaseMiner(ABC):
     def init_bittensor(self):
         self.subtensor = bt.subtensor(config=self.config)
         self.wallet = bt.wallet(config=self.config)
-        self.metagraph = self.subtensor.metagraph(netuid=self.config.netuid)
+        self.metagraph_cache = MetagraphCache(
+            self.subtensor,
+            self.config.netuid,
+            os.path.join(self.config.full_path, "metagraph.pkl"),
+        )
+        self.metagraph = self.metagraph_cache.get()
         self.axon = bt.axon(config=self.config)
         for forward_fn, blacklist_fn in self.attach_fns:
             self.axon.attach(forward_fn=forward_fn, blacklist_fn=blacklist_fn)
@@ -43,7 +49,7 @@ class BaseMiner(ABC):
         self.axon.start()
 
     def chain_sync(self):
-        self.metagraph.sync()
+        self.metagraph_cache.refresh()
 
     @abstractmethod
     async def forward(self, synapse: bt.Synapse) -> bt.Synapse: ...
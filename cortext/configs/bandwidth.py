@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Literal
 import random
 
 
@@ -9,6 +10,8 @@ class ModelConfig(BaseModel):
     synapse_type: str
     timeout: int
     allowed_params: list[str]
+    # Relative share of each miner's quota guaranteed to this model
+    quota_share: float = 1.0
 
 
 class BandwidthConfig(BaseModel):
@@ -17,6 +20,8 @@ class BandwidthConfig(BaseModel):
     model_configs: dict[str, ModelConfig]
     min_credit: int
     max_credit: int
+    # "fixed_window" resets a counter every interval, "token_bucket" refills continuously
+    rate_limit_mode: Literal["fixed_window", "token_bucket"] = "fixed_window"
 
     @property
     def sample_model(self) -> ModelConfig:
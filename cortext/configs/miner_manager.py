@@ -4,3 +4,24 @@ from pydantic import BaseModel
 class MinerManagerConfig(BaseModel):
     port: int
     host: str
+    quota_refresh_interval: float = 2.0
+    credit_sync_interval: int = 60
+    credit_max_age: int = 3600
+    credit_probe_concurrency: int = 64
+    credit_probe_timeout: float = 8.0
+    stats_decay: float = 0.1
+    latency_choices: int = 2
+    breaker_failure_threshold: int = 3
+    breaker_cooldown: float = 300.0
+    # Split every quota between models by their quota_share, with borrowing.
+    # Off by default: with every share protected, one model cannot use the
+    # whole window even when the others have no demand.
+    model_partitions: bool = False
+    # Warm-start snapshot written on every credit sync and loaded on startup
+    snapshot_path: str = "~/.cortext/miner_manager/snapshot.json"
+    snapshot_max_age: int = 86400
+    # Uploads to the subnet report server
+    report_timeout: float = 8.0
+    report_max_records: int = 2048
+    # Gzip upload bodies, only if the report server decodes Content-Encoding
+    report_compression: bool = False
@@ -4,3 +4,14 @@ from pydantic import BaseModel
 class OrganicConfig(BaseModel):
     host: str
     port: int
+    # Seconds an API key record is served from the in-process cache
+    api_key_cache_ttl: float = 60.0
+    api_key_cache_size: int = 10000
+    # Send a request to another miner when the first has not produced a token
+    # within the `hedge_quantile` of recent time-to-first-token. Every hedge
+    # spends credit of the miners' own rate limits, even when it loses.
+    hedge: bool = True
+    hedge_quantile: float = 0.9
+    hedge_initial_delay: float = 2.0
+    hedge_min_delay: float = 0.5
+    hedge_max_delay: float = 8.0
@@ -8,3 +8,10 @@ class RedisConfig(BaseModel):
     organic_queue_key: str
     synthetic_queue_key: str
     miner_manager_key: str
+    # Stream of tracking records appended by the validator for the miner manager
+    tracking_key: str = "tracking_stream"
+    tracking_max_len: int = 100000
+    # Pub/sub channel of metagraph diffs published by the subtensor syncing service
+    metagraph_channel: str = "metagraph_updates"
+    # Pub/sub channel announcing changed API keys to organic server processes
+    api_key_channel: str = "api_key_updates"
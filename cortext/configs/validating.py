@@ -5,3 +5,6 @@ class ValidatingConfig(BaseModel):
     synthetic_threshold: float
     synthetic_batch_size: int
     synthetic_concurrent_batches: int
+    # Score updates are sent to the miner manager once either limit is reached
+    score_flush_size: int = 256
+    score_flush_interval: float = 5.0
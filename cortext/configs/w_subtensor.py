@@ -4,3 +4,11 @@ from pydantic import BaseModel
 class WSubtensorConfig(BaseModel):
     host: str
     port: int
+    # Seconds a cached metagraph snapshot is used before it is revalidated
+    snapshot_max_age: float = 30.0
+    # Memory-mapped metagraph table shared with processes on the same host
+    table_path: str = "/dev/shm/cortext_metagraph"
+    # Set weights from the syncing service as soon as each tempo allows
+    schedule_weights: bool = True
+    # Directory where services persist the last synced metagraph
+    metagraph_cache_dir: str = "~/.cortext/metagraph"
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, PrivateAttr, validator
 from bittensor import StreamingSynapse, Synapse
 from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
 from starlette.responses import StreamingResponse
@@ -79,6 +79,21 @@ class ChatStreamingProtocol(StreamingSynapse):
     streaming_chunks: list[MinerResponse] = Field(
         description="The response from the miner", default=[]
     )
+    # Measured by the receiving side, never sent over the wire
+    _time_to_first_token: Optional[float] = PrivateAttr(default=None)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        return self._time_to_first_token
+
+    @property
+    def reached_miner(self) -> bool:
+        """False when the dendrite could not connect, so the miner never saw the call"""
+        # bittensor reports connection failures as 503 "Service unavailable"
+        return not (
+            str(self.dendrite.status_code) == "503"
+            and (self.dendrite.status_message or "").startswith("Service unavailable")
+        )
 
     @property
     def miner_response(self):
@@ -1,4 +1,7 @@
 from . import rate_limit
+from . import metagraph_snapshot
+from . import metagraph_table
+from . import metagraph_cache
 
 
-__all__ = ["rate_limit"]
+__all__ = ["rate_limit", "metagraph_snapshot", "metagraph_table", "metagraph_cache"]
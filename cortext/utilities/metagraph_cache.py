@@ -0,0 +1,74 @@
+import copy
+import os
+import pickle
+import time
+from loguru import logger
+
+
+class MetagraphCache:
+    """
+    Metagraph persisted to disk, so chain-dependent services start immediately.
+
+    `get` returns the last synced metagraph from `path` when there is one and
+    only falls back to the chain on a cold start. The owner's sync loop calls
+    `refresh`, which updates the returned object in place, so holders of the
+    metagraph see new state without re-fetching it.
+    """
+
+    def __init__(self, subtensor, netuid: int, path: str):
+        self.subtensor = subtensor
+        self.netuid = netuid
+        self.path = os.path.expanduser(path)
+        self.metagraph = None
+        self.synced_at = 0.0
+
+    def get(self):
+        """Return the cached metagraph, fetching it from the chain if there is none."""
+        if self.metagraph is None:
+            self.metagraph = self.load()
+        if self.metagraph is None:
+            self.refresh()
+        return self.metagraph
+
+    def load(self):
+        """Read the metagraph saved at `path`, or return None if it is unusable."""
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring metagraph cache {self.path}: {e}")
+            return None
+        metagraph = state["metagraph"]
+        metagraph.subtensor = self.subtensor
+        self.synced_at = state["synced_at"]
+        logger.info(
+            f"Loaded metagraph at block {metagraph.block.item()} from {self.path}, "
+            f"synced {time.time() - self.synced_at:.0f}s ago"
+        )
+        return metagraph
+
+    def save(self):
+        # The subtensor holds a live connection and cannot be pickled
+        metagraph = copy.copy(self.metagraph)
+        metagraph.subtensor = None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"synced_at": self.synced_at, "metagraph": metagraph}, f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Fetch the metagraph from the chain and persist it."""
+        fresh = self.subtensor.metagraph(netuid=self.netuid)
+        if self.metagraph is None:
+            self.metagraph = fresh
+        else:
+            vars(self.metagraph).update(vars(fresh))
+        self.synced_at = time.time()
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f"Failed to save metagraph cache {self.path}: {e}")
+        return self.metagraph
@@ -0,0 +1,299 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import time
+import bittensor as bt
+import httpx
+from loguru import logger
+from redis.asyncio import Redis
+from typing import Callable
+from .metagraph_table import MetagraphTable
+
+
+class MetagraphSnapshot:
+    """
+    Compact, versioned view of the metagraph.
+
+    The version is a digest of the content, so re-syncing an unchanged
+    metagraph keeps the version and cached copies stay valid. `AxonInfo`
+    objects are built lazily and reused for the lifetime of the snapshot.
+    """
+
+    def __init__(
+        self,
+        block: int,
+        uids: list[int],
+        hotkeys: list[str],
+        stakes: list[float],
+        axons: list[dict],
+        version: str = None,
+    ):
+        self.block = block
+        self.uids = uids
+        self.hotkeys = hotkeys
+        self.stakes = stakes
+        self.axons = axons
+        self.version = version or self._digest()
+        self._axon_infos: dict[int, bt.AxonInfo] = {}
+
+    @classmethod
+    def from_metagraph(cls, metagraph) -> "MetagraphSnapshot":
+        return cls(
+            block=metagraph.block.item(),
+            uids=metagraph.uids.tolist(),
+            hotkeys=list(metagraph.hotkeys),
+            stakes=[float(stake) for stake in metagraph.S],
+            axons=[dataclasses.asdict(axon) for axon in metagraph.axons],
+        )
+
+    @classmethod
+    def from_table(cls, table: MetagraphTable) -> "MetagraphSnapshot":
+        _, block, version, records = table.read()
+        return cls(
+            block=block,
+            uids=list(range(len(records))),
+            hotkeys=[record["hotkey"].decode() for record in records],
+            stakes=records["stake"].tolist(),
+            axons=[
+                {
+                    "version": int(record["axon_version"]),
+                    "ip": record["ip"].decode(),
+                    "port": int(record["port"]),
+                    "ip_type": int(record["ip_type"]),
+                    "hotkey": record["axon_hotkey"].decode(),
+                    "coldkey": record["coldkey"].decode(),
+                    "protocol": int(record["protocol"]),
+                    "placeholder1": int(record["placeholder1"]),
+                    "placeholder2": int(record["placeholder2"]),
+                }
+                for record in records
+            ],
+            version=version,
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MetagraphSnapshot":
+        return cls(**data)
+
+    def _content(self) -> dict:
+        # The block changes on every sync, so it is not part of the version
+        return {
+            "uids": self.uids,
+            "hotkeys": self.hotkeys,
+            "stakes": self.stakes,
+            "axons": self.axons,
+        }
+
+    def _digest(self) -> str:
+        content = json.dumps(self._content(), sort_keys=True).encode()
+        return hashlib.sha256(content).hexdigest()[:16]
+
+    def to_dict(self) -> dict:
+        return {"version": self.version, "block": self.block, **self._content()}
+
+    def diff(self, previous: "MetagraphSnapshot") -> dict:
+        """
+        Describe the changes from `previous` to this snapshot.
+
+        Only UIDs whose hotkey, stake or axon changed are listed, so the diff
+        can be applied with `apply` to a copy of `previous`.
+        """
+        changes = []
+        for uid in self.uids:
+            entry = (self.hotkeys[uid], self.stakes[uid], self.axons[uid])
+            if uid < len(previous) and entry == (
+                previous.hotkeys[uid],
+                previous.stakes[uid],
+                previous.axons[uid],
+            ):
+                continue
+            changes.append(
+                {
+                    "uid": uid,
+                    "hotkey": self.hotkeys[uid],
+                    "stake": self.stakes[uid],
+                    "axon": self.axons[uid],
+                }
+            )
+        return {
+            "version": self.version,
+            "previous_version": previous.version,
+            "block": self.block,
+            "size": len(self),
+            "changes": changes,
+        }
+
+    def apply(self, diff: dict) -> "MetagraphSnapshot":
+        """Return a new snapshot with `diff` applied on top of this one."""
+        size = diff["size"]
+        uids = list(range(size))
+        hotkeys = (self.hotkeys + [""] * size)[:size]
+        stakes = (self.stakes + [0.0] * size)[:size]
+        axons = (self.axons + [{}] * size)[:size]
+        for change in diff["changes"]:
+            uid = change["uid"]
+            hotkeys[uid] = change["hotkey"]
+            stakes[uid] = change["stake"]
+            axons[uid] = change["axon"]
+        return MetagraphSnapshot(
+            diff["block"], uids, hotkeys, stakes, axons, version=diff["version"]
+        )
+
+    def axon(self, uid: int) -> bt.AxonInfo:
+        if uid not in self._axon_infos:
+            self._axon_infos[uid] = bt.AxonInfo(**self.axons[uid])
+        return self._axon_infos[uid]
+
+    def axon_string(self, uid: int) -> str:
+        """Stable string form of the axon, used to detect axon changes."""
+        return json.dumps(self.axons[uid])
+
+    def __len__(self):
+        return len(self.uids)
+
+    def __repr__(self):
+        return f"MetagraphSnapshot(version={self.version}, block={self.block}, size={len(self)})"
+
+
+class MetagraphSnapshotClient:
+    """
+    Cached client for the snapshot served by the subtensor syncing service.
+
+    The snapshot is revalidated at most every `max_age` seconds with the
+    `If-None-Match` header, so an unchanged metagraph costs an empty 304
+    response and lookups in between are plain in-memory reads.
+
+    When the service shares a `MetagraphTable` at `table_path` on this host,
+    the snapshot is read from the table whenever its sequence changes, and
+    no HTTP request is made at all.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        max_age: float = 30.0,
+        table_path: str = None,
+    ):
+        self.client = client
+        self.max_age = max_age
+        self.table_path = table_path
+        self.table: MetagraphTable = None
+        self.table_sequence = None
+        self.snapshot: MetagraphSnapshot = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _read_table(self) -> bool:
+        """Load the shared table if it changed. Returns whether it is usable."""
+        if self.table is None:
+            return False
+        sequence = self.table.sequence
+        if sequence != self.table_sequence and sequence % 2 == 0:
+            self.snapshot = MetagraphSnapshot.from_table(self.table)
+            self.table_sequence = sequence
+            self.checked_at = time.monotonic()
+        return self.snapshot is not None
+
+    async def get(self) -> MetagraphSnapshot:
+        """Return the cached snapshot, revalidating it first if it is too old."""
+        if self._read_table():
+            return self.snapshot
+        if self.snapshot is None or time.monotonic() - self.checked_at > self.max_age:
+            async with self._lock:
+                if (
+                    self.snapshot is None
+                    or time.monotonic() - self.checked_at > self.max_age
+                ):
+                    await self.refresh()
+        return self.snapshot
+
+    async def refresh(self):
+        if self.table is None and self.table_path:
+            self.table = MetagraphTable.open(self.table_path)
+            if self._read_table():
+                return
+        headers = {}
+        if self.snapshot is not None:
+            headers["If-None-Match"] = f'"{self.snapshot.version}"'
+        response = await self.client.get("/api/metagraph", headers=headers, timeout=8)
+        self.checked_at = time.monotonic()
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        self.snapshot = MetagraphSnapshot.from_dict(response.json())
+        logger.info(f"Loaded {self.snapshot}")
+
+    async def listen(
+        self,
+        redis_client: Redis,
+        channel: str,
+        on_change: Callable[[list[dict]], None] = None,
+    ):
+        """
+        Apply metagraph diffs published on `channel` as soon as they arrive.
+
+        A diff already applied, because `get` read the new version from the
+        shared table first, is only reported. A diff that does not follow the
+        cached version, for instance after a missed message, triggers a full
+        refresh instead. So does every resubscription after the connection
+        dropped. `on_change` is called with the changed entries of every diff
+        or refresh.
+        """
+        resubscribing = False
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                if resubscribing:
+                    # Diffs published while unsubscribed are lost
+                    async with self._lock:
+                        changes = await self._full_refresh()
+                    self._notify(changes, on_change)
+                resubscribing = True
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        diff = json.loads(message["data"])
+                        async with self._lock:
+                            if (
+                                self.snapshot is not None
+                                and self.snapshot.version == diff["version"]
+                            ):
+                                # Already loaded from the shared table
+                                changes = diff["changes"]
+                            elif (
+                                self.snapshot is not None
+                                and self.snapshot.version == diff["previous_version"]
+                            ):
+                                self.snapshot = self.snapshot.apply(diff)
+                                self.checked_at = time.monotonic()
+                                changes = diff["changes"]
+                            else:
+                                changes = await self._full_refresh()
+                        logger.info(
+                            f"Metagraph changed for {len(changes)} UIDs: {self.snapshot}"
+                        )
+                        self._notify(changes, on_change)
+                    except Exception as e:
+                        logger.error(f"Error applying metagraph diff: {e}")
+            except Exception as e:
+                logger.error(f"Metagraph subscription lost, resubscribing: {e}")
+            finally:
+                # Every attempt holds its own connection
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    async def _full_refresh(self) -> list[dict]:
+        """Refresh the snapshot and return the changed entries. Hold the lock."""
+        previous = self.snapshot
+        await self.refresh()
+        if previous is None or self.snapshot is None:
+            return []
+        return self.snapshot.diff(previous)["changes"]
+
+    @staticmethod
+    def _notify(changes: list[dict], on_change: Callable[[list[dict]], None]):
+        if on_change and changes:
+            on_change(changes)
@@ -0,0 +1,153 @@
+import mmap
+import os
+import struct
+import time
+import numpy as np
+
+# magic, layout version, sequence, capacity, size, block, snapshot version
+HEADER = struct.Struct("<4sIQIIQ16s")
+MAGIC = b"CXMG"
+LAYOUT_VERSION = 1
+SEQUENCE_OFFSET = 8
+
+RECORD = np.dtype(
+    [
+        ("hotkey", "S48"),
+        ("stake", "<f8"),
+        ("axon_version", "<u4"),
+        ("ip", "S46"),
+        ("port", "<u2"),
+        ("ip_type", "u1"),
+        ("protocol", "u1"),
+        ("placeholder1", "u1"),
+        ("placeholder2", "u1"),
+        ("axon_hotkey", "S48"),
+        ("coldkey", "S48"),
+    ]
+)
+
+
+class MetagraphTable:
+    """
+    Fixed-layout metagraph table in a memory-mapped file.
+
+    The subtensor syncing service writes the table and co-located processes
+    map it read-only, so reading the current metagraph costs no RPC. Writes
+    are guarded by a sequence lock: the writer makes the sequence odd, updates
+    the records, then makes it even again. Readers copy the records and retry
+    if the sequence was odd or changed meanwhile.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        with open(path, "r+b" if writable else "rb") as f:
+            self._mmap = mmap.mmap(
+                f.fileno(),
+                0,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ,
+            )
+        magic, layout, _, capacity, _, _, _ = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            raise ValueError(f"{path} is not a metagraph table")
+        self.capacity = capacity
+        self._records = np.frombuffer(
+            self._mmap, dtype=RECORD, count=capacity, offset=HEADER.size
+        )
+
+    @classmethod
+    def create(cls, path: str, capacity: int = 1024) -> "MetagraphTable":
+        """Create an empty table, or reuse an existing one of the same capacity."""
+        size = HEADER.size + capacity * RECORD.itemsize
+        tmp_path = f"{path}.tmp"
+        try:
+            table = cls(path, writable=True)
+            if table.capacity == capacity:
+                return table
+            table.close()
+        except (OSError, ValueError):
+            pass
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, 0, capacity, 0, 0, b""))
+            f.truncate(size)
+        os.replace(tmp_path, path)
+        return cls(path, writable=True)
+
+    @classmethod
+    def open(cls, path: str) -> "MetagraphTable":
+        """Map an existing table read-only, or return None if there is none."""
+        try:
+            return cls(path)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def sequence(self) -> int:
+        return struct.unpack_from("<Q", self._mmap, SEQUENCE_OFFSET)[0]
+
+    def _set_sequence(self, sequence: int):
+        struct.pack_into("<Q", self._mmap, SEQUENCE_OFFSET, sequence)
+
+    def write(self, snapshot):
+        """Replace the table content with a `MetagraphSnapshot`."""
+        if len(snapshot) > self.capacity:
+            raise ValueError(
+                f"Metagraph of {len(snapshot)} UIDs exceeds capacity {self.capacity}"
+            )
+        records = np.zeros(len(snapshot), dtype=RECORD)
+        for uid in snapshot.uids:
+            axon = snapshot.axons[uid]
+            records[uid] = (
+                snapshot.hotkeys[uid].encode(),
+                snapshot.stakes[uid],
+                axon["version"],
+                axon["ip"].encode(),
+                axon["port"],
+                axon["ip_type"],
+                axon["protocol"],
+                axon["placeholder1"],
+                axon["placeholder2"],
+                axon["hotkey"].encode(),
+                axon["coldkey"].encode(),
+            )
+
+        # Odd while writing, also if a previous writer died halfway
+        sequence = self.sequence // 2 * 2 + 1
+        self._set_sequence(sequence)
+        self._records[: len(records)] = records
+        self._records[len(records) :] = np.zeros(1, dtype=RECORD)
+        HEADER.pack_into(
+            self._mmap,
+            0,
+            MAGIC,
+            LAYOUT_VERSION,
+            sequence,
+            self.capacity,
+            len(snapshot),
+            snapshot.block,
+            snapshot.version.encode(),
+        )
+        self._set_sequence(sequence + 1)
+
+    def read(self, timeout: float = 1.0) -> tuple[int, int, str, np.ndarray]:
+        """
+        Return a consistent copy of the table.
+
+        Returns:
+            tuple: (sequence, block, snapshot version, records of every UID)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            before = self.sequence
+            if before % 2 == 0:
+                _, _, _, _, size, block, version = HEADER.unpack_from(self._mmap)
+                records = self._records[:size].copy()
+                if self.sequence == before:
+                    return before, block, version.rstrip(b"\0").decode(), records
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Metagraph table {self.path} is not settling")
+            time.sleep(0)
+
+    def close(self):
+        self._records = None
+        self._mmap.close()
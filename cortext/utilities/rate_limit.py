@@ -1,16 +1,40 @@
 from ..global_config import CONFIG
+import numpy as np
+
+
+class StakeTable:
+    """
+    Rate limit proportion of every UID, computed once per metagraph sync.
+
+    UIDs with more than `min_stake` share the rate limit in proportion to
+    their stake, every other UID gets nothing.
+    """
+
+    def __init__(self, stakes, min_stake: float = None):
+        if min_stake is None:
+            min_stake = CONFIG.bandwidth.min_stake
+        stakes = np.asarray(stakes, dtype=np.float64)
+        self.eligible = stakes > min_stake
+        total_stake = stakes[self.eligible].sum()
+        self.proportions = np.zeros_like(stakes)
+        if total_stake > 0:
+            self.proportions[self.eligible] = stakes[self.eligible] / total_stake
+
+    @classmethod
+    def from_metagraph(cls, metagraph) -> "StakeTable":
+        return cls(metagraph.S)
+
+    def proportion(self, uid: int) -> float:
+        if not 0 <= uid < len(self.proportions):
+            return 0.0
+        return float(self.proportions[uid])
+
+    def eligible_uids(self) -> list[int]:
+        return np.flatnonzero(self.eligible).tolist()
+
+    def __len__(self):
+        return len(self.proportions)
 
 
 def get_rate_limit_proportion(metagraph, uid: int) -> float:
-    stake_array = metagraph.S
-    w_uids = [
-        i
-        for i in range(len(stake_array))
-        if stake_array[i] > CONFIG.bandwidth.min_stake
-    ]
-    if uid not in w_uids:
-        return 0
-    w_stakes = [stake_array[i] for i in w_uids]
-    total_stake = sum(w_stakes)
-    normalized_stakes = [stake / total_stake for stake in w_stakes]
-    return float(normalized_stakes[w_uids.index(uid)])
+    return StakeTable.from_metagraph(metagraph).proportion(uid)
@@ -1,4 +1,14 @@
+from .circuit_breaker import CircuitBreaker
 from .miner_manager import MinerManager
-from .serving_counter import ServingCounter
+from .miner_stats import MinerStatsTracker
+from .serving_counter import ServingCounter, ServingCounterRegistry
+from .top_performer_index import TopPerformerIndex
 
-__all__ = ["MinerManager", "ServingCounter"]
+__all__ = [
+    "CircuitBreaker",
+    "MinerManager",
+    "MinerStatsTracker",
+    "ServingCounter",
+    "ServingCounterRegistry",
+    "TopPerformerIndex",
+]
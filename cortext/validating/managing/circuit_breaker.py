@@ -0,0 +1,74 @@
+import time
+from loguru import logger
+
+
+class CircuitBreaker:
+    """
+    Per-UID circuit breaker for miners that keep failing or timing out.
+
+    A UID starts closed. After `failure_threshold` consecutive failures it is
+    opened and excluded from selection for `cooldown` seconds. Then it turns
+    half-open: a single probe request is let through, and its result either
+    closes the circuit again or reopens it for another cool-down.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures: dict[int, int] = {}
+        self.states: dict[int, str] = {}
+        # Time the circuit was opened, or the half-open probe was let through
+        self.changed_at: dict[int, float] = {}
+
+    def state(self, uid: int) -> str:
+        return self.states.get(uid, self.CLOSED)
+
+    def is_blocked(self, uid: int) -> bool:
+        """Whether the UID is currently excluded, without claiming a probe."""
+        state = self.state(uid)
+        if state == self.CLOSED:
+            return False
+        return time.time() - self.changed_at[uid] < self.cooldown
+
+    def allow(self, uid: int) -> bool:
+        """
+        Whether a request may be sent to the UID.
+
+        Once the cool-down has passed, the first caller gets True and becomes
+        the half-open probe. Other callers get False until the probe reports
+        back, or until another cool-down passes without a report.
+        """
+        if self.is_blocked(uid):
+            return False
+        if self.state(uid) != self.CLOSED:
+            self.states[uid] = self.HALF_OPEN
+            self.changed_at[uid] = time.time()
+            logger.info(f"Circuit half-open for UID {uid}, sending probe")
+        return True
+
+    def record(self, uid: int, success: bool):
+        if success:
+            if self.state(uid) != self.CLOSED:
+                logger.info(f"Circuit closed for UID {uid}")
+            self.failures.pop(uid, None)
+            self.states.pop(uid, None)
+            self.changed_at.pop(uid, None)
+            return
+        self.failures[uid] = self.failures.get(uid, 0) + 1
+        if (
+            self.state(uid) == self.HALF_OPEN
+            or self.failures[uid] >= self.failure_threshold
+        ):
+            if self.state(uid) != self.OPEN:
+                logger.warning(
+                    f"Circuit opened for UID {uid} after {self.failures[uid]} failures"
+                )
+            self.states[uid] = self.OPEN
+            self.changed_at[uid] = time.time()
+
+    def reset(self, uid: int):
+        self.record(uid, True)
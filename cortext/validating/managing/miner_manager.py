@@ -1,27 +1,51 @@
 import redis
+from redis import asyncio as aioredis
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from loguru import logger
 import numpy as np
 import bittensor as bt
 from .sql_schemas import Base, MinerMetadata
-from .serving_counter import ServingCounter
+from .serving_counter import ServingCounterRegistry
+from .top_performer_index import TopPerformerIndex
+from .weighted_sampler import FenwickSampler
+from .miner_stats import MinerStatsTracker
+from .circuit_breaker import CircuitBreaker
 from ...utilities.secure_request import get_headers
+from ...utilities.metagraph_snapshot import MetagraphSnapshotClient
+from ...utilities.rate_limit import StakeTable
 from ...global_config import CONFIG
 from ...protocol import Credit
 import asyncio
+from collections import OrderedDict
+import gzip
+import heapq
 import httpx
+import json
+import os
+import random
+import time
 import traceback
 
+# Consumer group and consumer reading the validator's tracking stream
+TRACKING_GROUP = "miner_manager"
+TRACKING_CONSUMER = "reporter"
+
 
 class MinerManager:
-    def __init__(self, network: str, netuid: int, wallet_name: str, wallet_hotkey: str):
-        self.subtensor = bt.subtensor(network=network)
-        self.metagraph = self.subtensor.metagraph(netuid=netuid)
+    def __init__(self, wallet_name: str, wallet_hotkey: str):
+        # Chain state comes from the subtensor syncing service, so the manager
+        # never connects to the chain itself
         self.wallet = bt.wallet(name=wallet_name, hotkey=wallet_hotkey)
         self.subtensor_client = httpx.AsyncClient(
             base_url=f"http://{CONFIG.w_subtensor.host}:{CONFIG.w_subtensor.port}",
         )
+        self.metagraph_snapshots = MetagraphSnapshotClient(
+            self.subtensor_client,
+            max_age=CONFIG.w_subtensor.snapshot_max_age,
+            table_path=CONFIG.w_subtensor.table_path,
+        )
+        self.metagraph_changed = asyncio.Event()
         self.uid = 0
         self.dendrite = bt.Dendrite(wallet=self.wallet)
         logger.info(f"Connecting to Redis at {CONFIG.redis.host}:{CONFIG.redis.port}")
@@ -33,6 +57,107 @@ class MinerManager:
         Base.metadata.create_all(self.engine)
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
+        self.serving_counters = ServingCounterRegistry(
+            self.redis_client,
+            partitions={
+                name: model_config.quota_share
+                for name, model_config in CONFIG.bandwidth.model_configs.items()
+            }
+            if CONFIG.miner_manager.model_partitions
+            else None,
+        )
+        # uid -> (axon string, timestamp after which the credit is re-probed)
+        self.credit_probes: dict[int, tuple[str, float]] = {}
+        self.remaining_quotas: dict[int, int] = {}
+        self.quota_sampler = FenwickSampler()
+        self.top_performers = TopPerformerIndex()
+        self.miner_stats = MinerStatsTracker(CONFIG.miner_manager.stats_decay)
+        # Median latency, assumed for miners without observations
+        self.default_latency = 1.0
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=CONFIG.miner_manager.breaker_failure_threshold,
+            cooldown=CONFIG.miner_manager.breaker_cooldown,
+        )
+        # reservation_id -> (uids, expiry) of requests that are still being served
+        self.in_flight: OrderedDict[str, tuple[set[int], float]] = OrderedDict()
+        self.in_flight_counts: dict[int, int] = {}
+        self.uids: list[int] = []
+        self.credits: list[int] = []
+        # Persistent client for the subnet report server
+        self.report_client = httpx.AsyncClient(
+            base_url=CONFIG.subnet_report_url,
+            timeout=CONFIG.miner_manager.report_timeout,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=8),
+        )
+        self.report_compression = CONFIG.miner_manager.report_compression
+        # Metadata records last acknowledged by the report server
+        self.reported_metadata: dict[int, dict] = {}
+        # The local SQL table is authoritative for scores, snapshot or not
+        self.top_performers.rebuild(
+            {uid: miner.accumulate_score for uid, miner in self.query().items()}
+        )
+        self._load_snapshot()
+
+    def _write_snapshot(self):
+        """Persist what is needed to serve requests right after a restart."""
+        snapshot = {
+            "timestamp": time.time(),
+            "uids": self.uids,
+            "credits": self.credits,
+            "credit_probes": self.credit_probes,
+            "quotas": self.serving_counters.quotas,
+        }
+        path = os.path.expanduser(CONFIG.miner_manager.snapshot_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(f"{path}.tmp", path)
+        logger.debug(f"Wrote snapshot of {len(self.uids)} UIDs to {path}")
+
+    def _load_snapshot(self) -> bool:
+        """
+        Restore the last snapshot if it is recent enough.
+
+        Quotas are reinstalled and the sampler is rebuilt so consumption works
+        immediately, while the background sync refreshes everything and only
+        re-probes credits that are due.
+        """
+        path = os.path.expanduser(CONFIG.miner_manager.snapshot_path)
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+            return False
+        age = time.time() - snapshot["timestamp"]
+        if age > CONFIG.miner_manager.snapshot_max_age:
+            logger.info(f"Ignoring snapshot {path} from {age:.0f}s ago")
+            return False
+
+        # JSON object keys are strings
+        def by_uid(mapping: dict) -> dict:
+            return {int(uid): value for uid, value in mapping.items()}
+
+        self.uids = snapshot["uids"]
+        self.credits = snapshot["credits"]
+        self.credit_probes = {
+            uid: tuple(probe)
+            for uid, probe in by_uid(snapshot["credit_probes"]).items()
+        }
+        self.serving_counters.set_quotas(by_uid(snapshot["quotas"]))
+        remaining = self.serving_counters.remaining()
+        self.remaining_quotas = dict(
+            zip(self.serving_counters.quotas, remaining.tolist())
+        )
+        self.quota_sampler.rebuild(
+            list(self.remaining_quotas), list(self.remaining_quotas.values())
+        )
+        logger.success(
+            f"Warm-started from snapshot of {len(self.uids)} UIDs taken {age:.0f}s ago"
+        )
+        return True
 
     async def run_background_tasks(self):
         # Get the current event loop
@@ -40,8 +165,25 @@ class MinerManager:
         loop = asyncio.get_running_loop()
         # Create background tasks
         logger.info("Creating background task for serving counter sync")
+        loop.create_task(self._sync_on_change_loop())
+        logger.info("Subscribing to metagraph changes")
         loop.create_task(
-            self.run_task_in_background(self._sync_serving_counter_loop, 600)
+            self.metagraph_snapshots.listen(
+                aioredis.Redis(
+                    host=CONFIG.redis.host, port=CONFIG.redis.port, db=CONFIG.redis.db
+                ),
+                CONFIG.redis.metagraph_channel,
+                on_change=self._on_metagraph_change,
+            )
+        )
+        logger.info("Creating background task for metadata reporting")
+        loop.create_task(self.run_task_in_background(self.post_metadata, 600))
+        logger.info("Creating background task for remaining quota refresh")
+        loop.create_task(
+            self.run_task_in_background(
+                self._refresh_remaining_quotas,
+                CONFIG.miner_manager.quota_refresh_interval,
+            )
         )
         logger.info("Creating background task for tracking data reporting")
         loop.create_task(
@@ -53,31 +195,82 @@ class MinerManager:
         logger.success("MinerManager initialization complete")
 
     async def sync_credit(self):
-        uids_request = await self.subtensor_client.post("/api/uids", timeout=4, json={})
-        uids = uids_request.json()["uids"]
-        axons_request = await self.subtensor_client.post(
-            "/api/axons", timeout=8, json={"uids": uids}
+        """
+        Refresh miner credits by probing axons with the `Credit` synapse.
+
+        Only UIDs whose axon (and therefore hotkey) changed, or whose last probe
+        is older than a randomized max age, are probed. Probes run concurrently
+        up to `credit_probe_concurrency`, so a full sweep takes about one timeout
+        and later sweeps are spread over time.
+        """
+        snapshot = await self.metagraph_snapshots.get()
+        uids = snapshot.uids
+        axon_strings = [snapshot.axon_string(uid) for uid in uids]
+
+        now = time.time()
+        stale = [
+            (uid, axon_string)
+            for uid, axon_string in zip(uids, axon_strings)
+            if uid not in self.credit_probes
+            or self.credit_probes[uid][0] != axon_string
+            or self.credit_probes[uid][1] <= now
+        ]
+        logger.info(f"Probing credit for {len(stale)}/{len(uids)} UIDs")
+
+        semaphore = asyncio.Semaphore(CONFIG.miner_manager.credit_probe_concurrency)
+
+        async def probe(uid: int) -> Credit:
+            async with semaphore:
+                return await self.dendrite.call(
+                    target_axon=snapshot.axon(uid),
+                    synapse=Credit(),
+                    timeout=CONFIG.miner_manager.credit_probe_timeout,
+                    deserialize=False,
+                )
+
+        responses = await asyncio.gather(
+            *[probe(uid) for uid, _ in stale], return_exceptions=True
         )
-        axons = axons_request.json()["axons"]
-        axons = [bt.AxonInfo.from_string(axon) for axon in axons]
-
-        batch_size = 32
-        responses = []
-        for i in range(0, len(axons), batch_size):
-            batch_axons = axons[i : i + batch_size]
-            batch_responses = await self.dendrite.forward(
-                axons=batch_axons, synapse=Credit(), timeout=8
-            )
-            responses.extend(batch_responses)
 
         metadata = self.query(uids)
-        credits = []
-        for uid, response in zip(uids, responses):
-            metadata[uid].set_credit(response.credit)
-            credits.append(metadata[uid].credit)
-        self.credits = credits
-        self.uids = uids
+        now = time.time()
+        for (uid, axon_string), response in zip(stale, responses):
+            if isinstance(response, Exception) or not response.is_success:
+                metadata[uid].set_credit(0)
+                # Retry failed probes on the next sweep instead of waiting max age
+                next_probe_at = now + CONFIG.miner_manager.credit_sync_interval
+            else:
+                metadata[uid].set_credit(response.credit)
+                next_probe_at = now + CONFIG.miner_manager.credit_max_age * (
+                    0.5 + random.random() / 2
+                )
+            self.credit_probes[uid] = (axon_string, next_probe_at)
         self.session.commit()
+        self.credits = [metadata[uid].credit for uid in uids]
+        self.uids = uids
+
+    def _on_metagraph_change(self, changes: list[dict]):
+        """Forget the state of UIDs whose axon changed and sync credits now."""
+        for change in changes:
+            uid = change["uid"]
+            probe = self.credit_probes.get(uid)
+            if probe and probe[0] != json.dumps(change["axon"]):
+                self.miner_stats.reset(uid)
+                self.circuit_breaker.reset(uid)
+        self.metagraph_changed.set()
+
+    async def _sync_on_change_loop(self):
+        """Sync credits every `credit_sync_interval`, or as soon as the metagraph changes."""
+        while True:
+            await self._sync_serving_counter_loop()
+            try:
+                await asyncio.wait_for(
+                    self.metagraph_changed.wait(),
+                    CONFIG.miner_manager.credit_sync_interval,
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.metagraph_changed.clear()
 
     async def run_task_in_background(self, task, repeat_interval: int = 600):
         while True:
@@ -87,39 +280,116 @@ class MinerManager:
     async def _sync_serving_counter_loop(self):
         try:
             logger.info("Syncing serving counter loop")
-            uids_request = await self.subtensor_client.post(
-                "/api/uids", timeout=4, json={}
-            )
-            uids = uids_request.json()["uids"]
             await self.sync_credit()
+            uids = self.uids
             metadata = self.query(uids)
-            percentage_rate_limit_request = await self.subtensor_client.post(
-                "/api/rate_limit_percentage",
-                timeout=4,
-                json={"uid": self.uid},
-            )
-            percentage_rate_limit = percentage_rate_limit_request.json()[
-                "rate_limit_percentage"
-            ]
+            snapshot = await self.metagraph_snapshots.get()
+            percentage_rate_limit = StakeTable(snapshot.stakes).proportion(self.uid)
             logger.info(f"Percentage rate limit: {percentage_rate_limit}")
             logger.info(f"Creating serving counters for {len(uids)} UIDs")
-            self.serving_counters = {
-                uid: ServingCounter(
-                    quota=int(metadata[uid].credit * percentage_rate_limit),
-                    uid=uid,
-                    redis_client=self.redis_client,
-                )
-                for uid in uids
-            }
+            self.serving_counters.set_quotas(
+                {uid: int(metadata[uid].credit * percentage_rate_limit) for uid in uids}
+            )
             logger.success(
                 f"Serving counters initialized with rate limit: {self.serving_counters}"
             )
-            await self.post_metadata()
+            await self._refresh_remaining_quotas()
+            self._write_snapshot()
         except Exception as e:
             traceback.print_exc()
             logger.error(f"Error in sync serving counter loop: {e}")
             await asyncio.sleep(600)
 
+    async def _refresh_remaining_quotas(self):
+        """Refresh the cached remaining quota of every serving counter."""
+        try:
+            self._update_default_latency()
+            uids = list(self.serving_counters.quotas)
+            remaining = self.serving_counters.remaining(uids)
+            self.remaining_quotas = dict(zip(uids, remaining.tolist()))
+            self.quota_sampler.rebuild(
+                uids,
+                [
+                    0 if self.circuit_breaker.is_blocked(uid) else quota
+                    for uid, quota in self.remaining_quotas.items()
+                ],
+            )
+        except Exception as e:
+            logger.error(f"Error refreshing remaining quotas: {e}")
+
+    def _record_consumption(self, uid: int, task_credit: int):
+        """Reflect a successful charge in the cached quota view and sampler."""
+        remaining = max(0, self.remaining_quotas.get(uid, 0) - task_credit)
+        self.remaining_quotas[uid] = remaining
+        self.quota_sampler.set(uid, remaining)
+
+    def _record_rejections(self, uids: list[int], task_credit: int):
+        """
+        Take rejected UIDs out of sampling until the next quota refresh.
+
+        The cached remaining quota is only lowered when the quota is actually
+        spent. Threshold and partition rejections leave it alone, since it
+        still ranks the UID for requests made without those limits.
+        """
+        if not uids:
+            return
+        remaining = self.serving_counters.remaining(uids)
+        for uid, quota in zip(uids, remaining.tolist()):
+            self.quota_sampler.set(uid, 0)
+            if quota < task_credit:
+                self.remaining_quotas[uid] = quota
+
+    def _track_in_flight(self, reservation_id: str, uids: list[int]):
+        """Count reserved UIDs as busy until the reservation settles or expires."""
+        now = time.time()
+        while self.in_flight and next(iter(self.in_flight.values()))[1] <= now:
+            _, (expired_uids, _) = self.in_flight.popitem(last=False)
+            for uid in expired_uids:
+                self.in_flight_counts[uid] -= 1
+        self.in_flight[reservation_id] = (set(uids), now + CONFIG.bandwidth.interval)
+        for uid in uids:
+            self.in_flight_counts[uid] = self.in_flight_counts.get(uid, 0) + 1
+
+    def _settle_in_flight(self, reservation_id: str, uids: list[int]):
+        if reservation_id not in self.in_flight:
+            return
+        pending, _ = self.in_flight[reservation_id]
+        for uid in pending.intersection(uids):
+            pending.discard(uid)
+            self.in_flight_counts[uid] -= 1
+        if not pending:
+            del self.in_flight[reservation_id]
+
+    def _update_default_latency(self):
+        latencies = [
+            latency
+            for latency in (
+                stats.latency.quantile(0.5) for stats in self.miner_stats.stats.values()
+            )
+            if latency > 0
+        ]
+        if latencies:
+            self.default_latency = float(np.median(latencies))
+
+    def _predicted_completion_time(self, uid: int, default_latency: float) -> float:
+        """Expected time to serve one more request from observed latency and load."""
+        stats = self.miner_stats.get(uid)
+        latency = default_latency
+        success_rate = 1.0
+        if stats is not None and stats.latency.quantile(0.5) > 0:
+            latency = stats.latency.quantile(0.5)
+            success_rate = max(stats.success_rate, 0.1)
+        return (self.in_flight_counts.get(uid, 0) + 1) * latency / success_rate
+
+    def _admit(self, uid: int) -> bool:
+        """Check the circuit breaker before sending a request to the UID."""
+        if not self.circuit_breaker.allow(uid):
+            return False
+        if self.circuit_breaker.state(uid) != CircuitBreaker.CLOSED:
+            # Half-open probe in flight, keep the UID out of sampling meanwhile
+            self.quota_sampler.set(uid, 0)
+        return True
+
     def query(self, uids: list[int] = []) -> dict[int, MinerMetadata]:
         logger.debug(f"Querying metadata for UIDs: {uids if uids else 'all'}")
         query = self.session.query(MinerMetadata)
@@ -139,69 +409,109 @@ class MinerManager:
         logger.success(f"Found {len(result)} miner metadata records")
         return result
 
-    def consume(self, threshold: float, k: int, task_credit: int):
+    def consume(
+        self,
+        threshold: float,
+        k: int,
+        task_credit: int,
+        reservation_id: str = None,
+        model: str = None,
+    ):
+        """
+        Charge `task_credit` to up to `k` UIDs sampled by remaining quota.
+
+        When `model` is given, the charge counts against that model's partition
+        of each quota, so one model cannot starve the others.
+        """
         logger.info(
             f"Starting credit consumption process: {task_credit} credit for {k} miners"
         )
 
-        # Get remaining quotas atomically using pipeline
-        logger.debug("Initializing Redis pipeline to fetch remaining quotas.")
-        pipe = self.redis_client.pipeline()
-        for uid in self.uids:
-            pipe.get(self.serving_counters[uid].key)
-            pipe.get(self.serving_counters[uid].quota_key)
-        results = pipe.execute()
-        logger.debug(f"Pipeline execution results: {results}")
-
-        # Calculate remaining quotas and probabilities
-        remaining_quotas = []
-        for i in range(0, len(results), 2):
-            current_count = int(results[i] or 0)
-            quota = int(results[i + 1] or 0)
-            remaining = max(0, quota - current_count)
-            remaining_quotas.append(remaining)
-
-        total_remaining = sum(remaining_quotas)
-        logger.info(f"Remaining quotas: {remaining_quotas}")
+        # Sample UIDs proportionally to their cached remaining quotas
+        total_remaining = self.quota_sampler.total
         logger.info(f"Total remaining quota across all UIDs: {total_remaining}")
         if total_remaining == 0:
             logger.warning("No remaining quota available for any UID.")
             return []
 
-        probabilities = np.array(remaining_quotas) / total_remaining
-        max_available_uid = len([p for p in probabilities if p > 0])
-        k = min(k, max_available_uid)
-        logger.info(
-            f"Calculated probabilities for UIDs. Max available UIDs: {max_available_uid}, Adjusted k: {k}"
-        )
-
-        # Select UIDs based on remaining quota probabilities
-        uids = np.random.choice(
-            self.uids, size=k, replace=False, p=probabilities
-        ).tolist()
+        uids = [uid for uid in self.quota_sampler.sample(k) if self._admit(uid)]
         logger.info(f"Selected UIDs for consumption: {uids}")
 
         # Attempt to consume atomically
-        consume_results = []
-        for uid in uids:
-            logger.debug(f"Attempting to consume credit for UID {uid}.")
-            consume_results.append(
-                self.serving_counters[uid].increment(task_credit, threshold)
-            )
+        consume_results = self.serving_counters.increment_many(
+            uids, task_credit, threshold, partition=model
+        )
+        for uid, result in zip(uids, consume_results):
+            if result:
+                self._record_consumption(uid, task_credit)
+        self._record_rejections(
+            [uid for uid, result in zip(uids, consume_results) if not result],
+            task_credit,
+        )
 
         # Filter successful consumptions
         uids = [uid for uid, result in zip(uids, consume_results) if result]
+        if reservation_id:
+            self.serving_counters.reserve(reservation_id, uids, task_credit, model)
+            self._track_in_flight(reservation_id, uids)
         logger.info(f"Successfully consumed {task_credit} credit for UIDs: {uids}.")
         return uids
 
+    def commit(self, reservation_id: str, uids: list[int] = None) -> list[int]:
+        """Confirm that reserved credit was spent on served requests."""
+        uids = self.serving_counters.commit(reservation_id, uids)
+        self._settle_in_flight(reservation_id, uids)
+        logger.info(f"Committed reservation {reservation_id} for UIDs: {uids}")
+        return uids
+
+    def release(self, reservation_id: str, uids: list[int] = None) -> list[int]:
+        """Refund reserved credit of failed or discarded requests."""
+        released = self.serving_counters.release(reservation_id, uids)
+        self._settle_in_flight(reservation_id, list(released))
+        for uid, amount in released.items():
+            remaining = self.remaining_quotas.get(uid, 0) + amount
+            self.remaining_quotas[uid] = remaining
+            self.quota_sampler.set(uid, remaining)
+        logger.info(f"Released reservation {reservation_id} for UIDs: {released}")
+        return list(released)
+
     def step(self, scores: list[float], total_uids: list[int]):
+        self.step_many([(scores, total_uids)])
+
+    def step_many(self, steps: list[tuple[list[float], list[int]]]):
+        """
+        Apply several score updates in order with a single commit.
+
+        Each step updates the EMA of its UIDs exactly as a separate `step`
+        call would, so a UID scored in several steps decays once per step.
+        """
+        miners = self.query(
+            list({uid for _, total_uids in steps for uid in total_uids})
+        )
+        try:
+            for scores, total_uids in steps:
+                self._apply_step(miners, scores, total_uids)
+            self.session.commit()
+        except Exception:
+            # Apply all steps or none, so a retry does not decay UIDs twice
+            self.session.rollback()
+            raise
+        for uid, miner in miners.items():
+            self.top_performers.update(uid, miner.accumulate_score)
+        logger.success(f"Updated metadata for {len(miners)} uids in {len(steps)} steps")
+
+    def _apply_step(
+        self,
+        miners: dict[int, MinerMetadata],
+        scores: list[float],
+        total_uids: list[int],
+    ):
         logger.info(f"Updating scores for {len(total_uids)} miners")
         credits = [self.credits[uid] for uid in total_uids]
         credits = np.array(credits)
         credit_scales = np.array(credits) / CONFIG.bandwidth.max_credit
         credit_scales[credit_scales > 1] = 1
         logger.info(f"Credit scales: {credit_scales}")
-        miners = self.query(total_uids)
         for uid, score, credit_scale in zip(total_uids, scores, credit_scales):
             logger.info(
                 f"Processing UID {uid} with score {score}:score*credit_scale:{credit_scale}"
@@ -217,8 +527,34 @@ class MinerManager:
             logger.info(
                 f"Updated accumulate_score for UID {uid}: {miner.accumulate_score}"
             )
-        self.session.commit()
-        logger.success(f"Updated metadata for {len(total_uids)} uids")
+
+    def record_results(self, results: list[dict]):
+        """
+        Update rolling per-UID statistics with the outcome of miner calls.
+
+        Each result holds `uid`, `success`, `response_time` and optionally `ttft`
+        (time to first token), all times in seconds.
+        """
+        for result in results:
+            uid = result["uid"]
+            self.miner_stats.update(
+                uid, result["success"], result["response_time"], result.get("ttft")
+            )
+            self.circuit_breaker.record(uid, result["success"])
+            self.quota_sampler.set(
+                uid,
+                0
+                if self.circuit_breaker.is_blocked(uid)
+                else self.remaining_quotas.get(uid, 0),
+            )
+        logger.debug(f"Recorded {len(results)} miner results")
+
+    def get_miner_stats(self) -> dict[int, dict]:
+        """Rolling statistics and circuit state of every UID with results."""
+        return {
+            uid: {**stats, "circuit_state": self.circuit_breaker.state(uid)}
+            for uid, stats in self.miner_stats.to_dict().items()
+        }
 
     @property
     def weights(self):
@@ -244,169 +580,286 @@ class MinerManager:
             logger.error(f"Error in weights: {e}")
             return [], []
 
+    async def _post_report(self, path: str, payload) -> httpx.Response:
+        """
+        POST a JSON payload to the report server, gzipped if enabled.
+
+        If the server rejects a compressed body, the payload is sent again
+        uncompressed and compression stays off from then on.
+        """
+        content = json.dumps(payload).encode()
+        headers = {
+            **get_headers(self.dendrite.keypair),
+            "Content-Type": "application/json",
+        }
+        if self.report_compression:
+            response = await self.report_client.post(
+                path,
+                content=gzip.compress(content),
+                headers={**headers, "Content-Encoding": "gzip"},
+            )
+            if response.status_code not in (400, 415, 422):
+                return response
+            logger.warning(
+                f"Report server rejected a compressed body with {response.status_code}, "
+                "disabling compression"
+            )
+            self.report_compression = False
+        return await self.report_client.post(path, content=content, headers=headers)
+
     async def post_metadata(self):
+        """Upload the metadata records that changed since the last acknowledged upload."""
         try:
-            logger.info("Posting metadata")
-            headers = get_headers(self.dendrite.keypair)
-            logger.debug(f"Headers: {headers}")
-            metadata = self.query()
-            metadata = {uid: miner.to_dict() for uid, miner in metadata.items()}
-            logger.info(f"Metadata: {metadata}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{CONFIG.subnet_report_url}/api/report_metadata",
-                    timeout=4,
-                    json=metadata,
-                    headers=headers,
-                )
+            metadata = {uid: miner.to_dict() for uid, miner in self.query().items()}
+            changed = {
+                uid: record
+                for uid, record in metadata.items()
+                if self.reported_metadata.get(uid) != record
+            }
+            if not changed:
+                logger.debug("No metadata changes to post")
+                return
+            logger.info(f"Posting metadata of {len(changed)} UIDs")
+            response = await self._post_report("/api/report_metadata", changed)
             logger.debug(f"Response: {response}")
+            if response.status_code == 200:
+                self.reported_metadata.update(changed)
         except Exception as e:
             logger.error(f"Error in post metadata: {e}")
             return
 
-    def consume_top_performers(self, n: int, task_credit: int, threshold: float = 1.0):
+    def consume_top_performers(
+        self,
+        n: int,
+        task_credit: int,
+        threshold: float = 1.0,
+        reservation_id: str = None,
+        strategy: str = "score",
+        model: str = None,
+        exclude: list[int] = None,
+    ):
         """
         Consume credits from top N performing UIDs based on accumulated scores.
         After selecting the top N based on the scores, it further sorts them
         in descending order by their remaining credit (i.e. more remaining credit first)
         and then attempts to consume credit from the first UID satisfying the threshold.
 
+        With the "latency" strategy, candidates are instead picked by power-of-d
+        choices: d random UIDs with enough remaining credit are drawn from the top
+        N and the one with the lowest predicted completion time is tried first.
+
         Args:
             n (int): Number of top performers to select
             task_credit (int): Amount of credit to consume
             threshold (float): Threshold for credit consumption (default: 1.0)
+            reservation_id (str): Record the charge under this reservation so it
+                can later be committed or released (default: None)
+            strategy (str): "score" or "latency" candidate ordering (default: "score")
+            model (str): Charge the credit to this model's quota partition (default: None)
+            exclude (list[int]): UIDs that must not be selected (default: None)
 
         Returns:
             list[int]: List of UIDs that were successfully consumed
         """
         logger.info(f"Consuming credits from top {n} performers")
 
-        # Get all miners and their scores
-        miners = self.query()
-        uid_scores = [
-            (uid, miner.accumulate_score)
-            for uid, miner in miners.items()
-            if miner.accumulate_score > 0.01
+        # Top N UIDs come pre-sorted from the ranked index maintained by step()
+        excluded = set(exclude or [])
+        top_performers = [
+            (uid, score)
+            for uid, score in self.top_performers.top(n)
+            if uid in self.serving_counters and uid not in excluded
         ]
-
-        # Sort by accumulated score in descending order
-        uid_scores.sort(key=lambda x: x[1], reverse=True)
-
-        # Select top N UIDs based on accumulated scores
-        top_uids = [uid for uid, _ in uid_scores[:n]]
         logger.info(
-            f"Selected top {len(top_uids)} UIDs based on accumulate_score: {top_uids}, {uid_scores[:n]}"
+            f"Selected top {len(top_performers)} UIDs based on accumulate_score: {top_performers}"
         )
 
-        # Further sort the top UIDs by remaining credit in descending order (more remaining credit first)
-        # Using a Redis pipeline to atomically fetch the current consumption and quota for each UID.
-        pipe = self.redis_client.pipeline()
-        for uid in top_uids:
-            pipe.get(self.serving_counters[uid].key)
-            pipe.get(self.serving_counters[uid].quota_key)
-        results = pipe.execute()
-
-        uid_remaining = []
-        for index, uid in enumerate(top_uids):
-            current = int(results[2 * index] or 0)
-            quota = int(results[2 * index + 1] or 0)
-            remaining = max(0, quota - current)
-            uid_remaining.append((uid, remaining, miners[uid].accumulate_score))
-            logger.debug(
-                f"UID {uid}: current_count = {current}, quota = {quota}, remaining = {remaining}"
-            )
-
-        logger.info(f"UID remaining: {uid_remaining}")
-
-        sorted_top_uids = [
-            uid
-            for uid, _, _ in sorted(
-                uid_remaining, key=lambda x: x[1] * x[2], reverse=True
-            )
-        ]
-        logger.info(f"Top UIDs sorted by remaining credit: {sorted_top_uids}")
+        if strategy == "latency":
+            candidates = self._latency_candidates(top_performers, task_credit)
+        else:
+            candidates = self._score_candidates(top_performers)
 
         selected_uid = None
-        for uid in sorted_top_uids:
+        rejected = []
+        for uid in candidates:
+            if not self._admit(uid):
+                continue
             logger.debug(f"Attempting to consume credit for top performer UID {uid}")
-            if self.serving_counters[uid].increment(task_credit, threshold):
+            if self.serving_counters.increment(uid, task_credit, threshold, model):
                 selected_uid = uid
                 break
+            rejected.append(uid)
+        self._record_rejections(rejected, task_credit)
 
         if selected_uid is None:
             logger.warning("No top performing miners found")
             return []
 
+        self._record_consumption(selected_uid, task_credit)
+        if reservation_id:
+            self.serving_counters.reserve(
+                reservation_id, [selected_uid], task_credit, model
+            )
+            self._track_in_flight(reservation_id, [selected_uid])
         return [selected_uid]
 
-    async def _report_tracking_data(self):
-        """Collect and report tracking data from Redis"""
+    def _score_candidates(self, top_performers: list[tuple[int, float]]):
+        """Yield UIDs by score * remaining credit using the cached quota view."""
+        # The cache may lag behind Redis, but increment() is authoritative.
+        candidates = [
+            (-score * self.remaining_quotas.get(uid, 0), uid)
+            for uid, score in top_performers
+        ]
+        heapq.heapify(candidates)
+        while candidates:
+            yield heapq.heappop(candidates)[1]
+
+    def _latency_candidates(
+        self, top_performers: list[tuple[int, float]], task_credit: int
+    ):
+        """Yield UIDs by power-of-d choices on predicted completion time."""
+        eligible = []
+        ineligible = []
+        for uid, score in top_performers:
+            if self.remaining_quotas.get(uid, 0) >= task_credit:
+                eligible.append(uid)
+            else:
+                ineligible.append((uid, score))
+        while eligible:
+            choices = random.sample(
+                range(len(eligible)),
+                min(CONFIG.miner_manager.latency_choices, len(eligible)),
+            )
+            best = min(
+                choices,
+                key=lambda index: self._predicted_completion_time(
+                    eligible[index], self.default_latency
+                ),
+            )
+            uid = eligible[best]
+            eligible[best] = eligible[-1]
+            eligible.pop()
+            yield uid
+        # Cached quotas can be stale, fall back to the remaining top performers
+        yield from self._score_candidates(ineligible)
+
+    def _read_tracking_entries(self) -> list[tuple[bytes, dict]]:
+        """
+        Read tracking entries through the manager's consumer group.
+
+        Entries delivered earlier but never acknowledged, for instance because
+        their upload failed, are returned first. New entries follow once none
+        are pending, so every entry is reported at least once.
+        """
+        key = CONFIG.redis.tracking_key
         try:
-            logger.info("Collecting tracking data from Redis")
+            self.redis_client.xgroup_create(key, TRACKING_GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        for stream_id in ("0", ">"):
+            streams = self.redis_client.xreadgroup(
+                TRACKING_GROUP,
+                TRACKING_CONSUMER,
+                {key: stream_id},
+                count=CONFIG.miner_manager.report_max_records,
+            )
+            entries = streams[0][1] if streams else []
+            if entries:
+                return entries
+        return []
+
+    @staticmethod
+    def _format_tracking_entry(data: dict) -> dict:
+        return {
+            "batch_id": data[b"batch_id"].decode(),
+            "uid": int(data[b"uid"]),
+            "model": data[b"model"].decode(),
+            "score": float(data[b"score"]),
+            "response_time": float(data[b"response_time"]),
+            "invalid_reason": data[b"invalid_reason"].decode(),
+            "timestamp": float(data[b"timestamp"]),
+        }
 
-            # Get all tracking keys
-            tracking_keys = self.redis_client.keys("tracking:*")
-            if not tracking_keys:
-                logger.debug("No tracking data found")
-                return
+    async def _report_tracking_data(self):
+        """
+        Report tracking records streamed by the validator.
 
-            # Get all tracking data using pipeline
-            pipe = self.redis_client.pipeline()
-            for key in tracking_keys:
-                pipe.hgetall(key)
-            tracking_data = pipe.execute()
-
-            # Format data for reporting
-            batch_data = {}
-            for key, data in zip(tracking_keys, tracking_data):
-                if not data:  # Skip if data is empty
-                    continue
-
-                # Convert Redis bytes to proper types
-                formatted_data = {
-                    "batch_id": data[b"batch_id"].decode(),
-                    "uid": int(data[b"uid"]),
-                    "model": data[b"model"].decode(),
-                    "score": float(data[b"score"]),
-                    "response_time": float(data[b"response_time"]),
-                    "invalid_reason": data[b"invalid_reason"].decode(),
-                    "timestamp": float(data[b"timestamp"]),
-                }
-
-                # Group by batch_id
-                batch_id = formatted_data["batch_id"]
-                if batch_id not in batch_data:
-                    batch_data[batch_id] = []
-                batch_data[batch_id].append(formatted_data)
-
-            # Report each batch
-            headers = get_headers(self.dendrite.keypair)
-            async with httpx.AsyncClient() as client:
-                for batch_id, responses in batch_data.items():
+        Entries are grouped by batch and uploaded in bundles, then acknowledged
+        in the consumer group. A failed upload leaves them pending, so they are
+        delivered again on the next run.
+        """
+        try:
+            while True:
+                entries = self._read_tracking_entries()
+                if not entries:
+                    logger.debug("No tracking data found")
+                    return
+
+                batch_data: dict[str, list[dict]] = {}
+                malformed = []
+                for entry_id, data in entries:
                     try:
-                        payload = {"batch_id": batch_id, "responses": responses}
-                        response = await client.post(
-                            f"{CONFIG.subnet_report_url}/api/report_batch",
-                            timeout=4,
-                            json=payload,
-                            headers=headers,
-                        )
-                        if response.status_code == 200:
-                            logger.info(f"Successfully reported batch {batch_id}")
-                            # Delete reported keys using pipeline
-                            pipe = self.redis_client.pipeline()
-                            for data in responses:
-                                key = f"tracking:{data['batch_id']}:{data['uid']}"
-                                pipe.delete(key)
-                            pipe.execute()
-                        else:
-                            logger.error(
-                                f"Failed to report batch {batch_id}: {response.status_code}"
-                            )
-                    except Exception as e:
-                        logger.error(f"Error reporting batch {batch_id}: {str(e)}")
+                        formatted_data = self._format_tracking_entry(data)
+                    except (KeyError, TypeError, ValueError):
+                        # Trimmed while pending, or never valid: it would
+                        # block every later run if left unacknowledged
+                        malformed.append(entry_id)
                         continue
-
+                    batch_data.setdefault(formatted_data["batch_id"], []).append(
+                        formatted_data
+                    )
+                if malformed:
+                    logger.warning(
+                        f"Dropping {len(malformed)} malformed tracking entries"
+                    )
+                    self.redis_client.xack(
+                        CONFIG.redis.tracking_key, TRACKING_GROUP, *malformed
+                    )
+                batches = [
+                    {"batch_id": batch_id, "responses": responses}
+                    for batch_id, responses in batch_data.items()
+                ]
+
+                if batches:
+                    if not await self._post_batches(batches):
+                        return
+                    self.redis_client.xack(
+                        CONFIG.redis.tracking_key,
+                        TRACKING_GROUP,
+                        *[
+                            entry_id
+                            for entry_id, _ in entries
+                            if entry_id not in malformed
+                        ],
+                    )
+                logger.info(
+                    f"Reported {len(entries) - len(malformed)} tracking records in {len(batches)} batches"
+                )
+                if len(entries) < CONFIG.miner_manager.report_max_records:
+                    return
         except Exception as e:
             traceback.print_exc()
             logger.error(f"Error in tracking data reporting: {str(e)}")
+
+    async def _post_batches(self, batches: list[dict]) -> bool:
+        """Upload batches in one bundle, or one by one if bundles are unsupported."""
+        response = await self._post_report("/api/report_batches", {"batches": batches})
+        if response.status_code == 200:
+            return True
+        if response.status_code not in (404, 405):
+            logger.error(f"Failed to report batches: {response.status_code}")
+            return False
+
+        responses = await asyncio.gather(
+            *[self._post_report("/api/report_batch", batch) for batch in batches],
+            return_exceptions=True,
+        )
+        failed = [
+            batch["batch_id"]
+            for batch, response in zip(batches, responses)
+            if isinstance(response, Exception) or response.status_code != 200
+        ]
+        if failed:
+            logger.error(f"Failed to report batches {failed}")
+        return not failed
@@ -0,0 +1,115 @@
+import math
+import time
+
+
+class DecayedQuantileSketch:
+    """
+    Compact latency sketch over log-spaced buckets with exponential decay.
+
+    Every observation scales the existing bucket weights by (1 - decay) before
+    adding itself, so the quantiles follow recent behaviour. Updates and queries
+    touch a fixed number of buckets, which keeps them O(1) in the number of
+    observations.
+    """
+
+    def __init__(
+        self,
+        decay: float,
+        min_value: float = 0.01,
+        max_value: float = 256.0,
+        buckets_per_doubling: int = 4,
+    ):
+        self.decay = decay
+        self.min_value = min_value
+        self.ratio = 2 ** (1 / buckets_per_doubling)
+        size = math.ceil(math.log(max_value / min_value, self.ratio)) + 1
+        self.weights = [0.0] * size
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        index = int(math.log(value / self.min_value, self.ratio)) + 1
+        return min(index, len(self.weights) - 1)
+
+    def _upper_edge(self, index: int) -> float:
+        return self.min_value * self.ratio**index
+
+    def update(self, value: float):
+        keep = 1 - self.decay
+        for index in range(len(self.weights)):
+            self.weights[index] *= keep
+        self.weights[self._bucket(value)] += 1.0
+
+    def quantile(self, q: float) -> float:
+        """Return the q-quantile, interpolated geometrically inside its bucket."""
+        total = sum(self.weights)
+        if total <= 0:
+            return 0.0
+        target = q * total
+        cumulative = 0.0
+        for index, weight in enumerate(self.weights):
+            if weight > 0 and cumulative + weight >= target:
+                if index == 0:
+                    return self.min_value
+                fraction = (target - cumulative) / weight
+                return self._upper_edge(index - 1) * self.ratio**fraction
+            cumulative += weight
+        return self._upper_edge(len(self.weights) - 1)
+
+
+class MinerStats:
+    """Rolling reliability and latency statistics of a single miner."""
+
+    def __init__(self, decay: float):
+        self.decay = decay
+        self.success_rate = 1.0
+        self.ttft = 0.0
+        self.latency = DecayedQuantileSketch(decay)
+        self.count = 0
+        self.last_seen = 0.0
+
+    def update(self, success: bool, response_time: float, ttft: float = None):
+        self.count += 1
+        self.last_seen = time.time()
+        self.success_rate += self.decay * (float(success) - self.success_rate)
+        if not success:
+            return
+        self.latency.update(response_time)
+        if ttft is None:
+            return
+        if self.ttft == 0:
+            self.ttft = ttft
+        else:
+            self.ttft += self.decay * (ttft - self.ttft)
+
+    def to_dict(self):
+        return {
+            "success_rate": self.success_rate,
+            "ttft": self.ttft,
+            "p50_latency": self.latency.quantile(0.5),
+            "p95_latency": self.latency.quantile(0.95),
+            "count": self.count,
+            "last_seen": self.last_seen,
+        }
+
+
+class MinerStatsTracker:
+    """Per-UID `MinerStats`, created on the first result of each UID."""
+
+    def __init__(self, decay: float):
+        self.decay = decay
+        self.stats: dict[int, MinerStats] = {}
+
+    def update(self, uid: int, success: bool, response_time: float, ttft: float = None):
+        if uid not in self.stats:
+            self.stats[uid] = MinerStats(self.decay)
+        self.stats[uid].update(success, response_time, ttft)
+
+    def get(self, uid: int) -> MinerStats:
+        return self.stats.get(uid)
+
+    def reset(self, uid: int):
+        self.stats.pop(uid, None)
+
+    def to_dict(self):
+        return {uid: stats.to_dict() for uid, stats in self.stats.items()}
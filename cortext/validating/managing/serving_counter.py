@@ -1,5 +1,6 @@
 from ...global_config import CONFIG
 import redis
+import numpy as np
 from loguru import logger
 
 
@@ -62,3 +63,427 @@ class ServingCounter:
 
     def __repr__(self):
         return f"ServingCounter(quota={self.quota}, key={self.key})"
+
+
+# Shared by the increment scripts. With partitions enabled, every UID brings
+# 1 + partitions keys: its counter, then one usage counter per partition. A
+# partition may always spend its share of the quota, and may borrow beyond it
+# as long as every other partition keeps the protected fraction of its unused
+# share available.
+# ARGV: amount, threshold (negative to disable), interval, partition index
+# (0 to disable), partition count, protected fraction, one share per
+# partition, then the UIDs.
+PARTITION_PRELUDE = """
+local amount = tonumber(ARGV[1])
+local threshold = tonumber(ARGV[2])
+local interval = tonumber(ARGV[3])
+local partition = tonumber(ARGV[4])
+local partitions = tonumber(ARGV[5])
+local protected = tonumber(ARGV[6])
+local shares = {}
+for j = 1, partitions do
+    shares[j] = tonumber(ARGV[6 + j])
+end
+local stride = 1 + partitions
+local first_uid = 7 + partitions
+
+local function partition_allows(key, used, quota)
+    if partition == 0 then
+        return true
+    end
+    local own = 0
+    local guaranteed = 0
+    for j = 1, partitions do
+        local part_used = tonumber(redis.call('GET', KEYS[key + j]) or '0')
+        if j == partition then
+            own = part_used
+        else
+            guaranteed = guaranteed
+                + protected * math.max(0, shares[j] * quota - part_used)
+        end
+    end
+    return own + amount <= shares[partition] * quota
+        or used + amount <= quota - guaranteed
+end
+
+local function charge_partition(key)
+    if partition == 0 then
+        return
+    end
+    local part_key = KEYS[key + partition]
+    if redis.call('INCRBY', part_key, amount) == amount then
+        redis.call('EXPIRE', part_key, interval)
+    end
+end
+"""
+
+# Atomically applies the ServingCounter.increment rules to many UIDs.
+# KEYS[1] is the quota hash, then the keys of each UID as in PARTITION_PRELUDE.
+INCREMENT_MANY_SCRIPT = (
+    PARTITION_PRELUDE
+    + """
+local results = {}
+for i = 0, (#KEYS - 1) / stride - 1 do
+    local key = 2 + i * stride
+    local quota = tonumber(redis.call('HGET', KEYS[1], ARGV[first_uid + i]) or '0')
+    local allowed = 0
+    if quota > 0 then
+        local current = tonumber(redis.call('GET', KEYS[key]) or '0')
+        if (threshold < 0 or current / quota < threshold)
+            and partition_allows(key, current, quota) then
+            local count = redis.call('INCRBY', KEYS[key], amount)
+            if count == amount then
+                redis.call('EXPIRE', KEYS[key], interval)
+            end
+            if count <= quota then
+                allowed = 1
+                charge_partition(key)
+            end
+        end
+    end
+    results[#results + 1] = allowed
+end
+return results
+"""
+)
+
+
+# Token bucket variant of INCREMENT_MANY_SCRIPT. Each counter key is a hash holding
+# the current tokens and the last refill time; buckets refill continuously at
+# quota / interval tokens per second and hold at most quota tokens. Partition
+# usage is still counted per fixed window.
+TOKEN_BUCKET_INCREMENT_MANY_SCRIPT = (
+    PARTITION_PRELUDE
+    + """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local results = {}
+for i = 0, (#KEYS - 1) / stride - 1 do
+    local key = 2 + i * stride
+    local quota = tonumber(redis.call('HGET', KEYS[1], ARGV[first_uid + i]) or '0')
+    local allowed = 0
+    if quota > 0 then
+        local bucket = redis.call('HMGET', KEYS[key], 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or quota
+        local ts = tonumber(bucket[2]) or now
+        tokens = math.min(quota, tokens + (now - ts) * quota / interval)
+        if threshold < 0 or (quota - tokens) / quota < threshold then
+            if tokens >= amount and partition_allows(key, quota - tokens, quota) then
+                tokens = tokens - amount
+                allowed = 1
+                charge_partition(key)
+            end
+        end
+        redis.call('HSET', KEYS[key], 'tokens', tostring(tokens), 'ts', tostring(now))
+        redis.call('EXPIRE', KEYS[key], interval * 2)
+    end
+    results[#results + 1] = allowed
+end
+return results
+"""
+)
+
+# Reads the refilled token count of each bucket without consuming anything.
+TOKEN_BUCKET_REMAINING_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local results = {}
+for i = 2, #KEYS do
+    local quota = tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0')
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or quota
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(quota, tokens + (now - ts) * quota / interval)
+    results[#results + 1] = math.floor(math.max(tokens, 0))
+end
+return results
+"""
+
+
+# Refunds pending reservations. KEYS[1] is the quota hash, KEYS[2] the reservation
+# hash, then per UID its counter key, followed by its partition usage key when
+# the reservation was made for a partition. ARGV: mode, keys per UID, then the
+# UIDs. Returns a flat list of (uid, refunded amount) pairs for reservations found.
+RELEASE_SCRIPT = """
+local token_bucket = ARGV[1] == 'token_bucket'
+local stride = tonumber(ARGV[2])
+local released = {}
+for i = 0, (#KEYS - 2) / stride - 1 do
+    local key = 3 + i * stride
+    local uid = ARGV[3 + i]
+    local amount = tonumber(redis.call('HGET', KEYS[2], uid) or '0')
+    if amount > 0 then
+        redis.call('HDEL', KEYS[2], uid)
+        if token_bucket then
+            local tokens = redis.call('HGET', KEYS[key], 'tokens')
+            if tokens then
+                local quota = tonumber(redis.call('HGET', KEYS[1], uid) or '0')
+                tokens = math.min(quota, tonumber(tokens) + amount)
+                redis.call('HSET', KEYS[key], 'tokens', tostring(tokens))
+            end
+        else
+            local count = redis.call('GET', KEYS[key])
+            if count then
+                redis.call('DECRBY', KEYS[key], math.min(amount, tonumber(count)))
+            end
+        end
+        if stride > 1 then
+            local used = redis.call('GET', KEYS[key + 1])
+            if used then
+                redis.call('DECRBY', KEYS[key + 1], math.min(amount, tonumber(used)))
+            end
+        end
+        released[#released + 1] = uid
+        released[#released + 1] = amount
+    end
+end
+return released
+"""
+
+
+class ServingCounterRegistry:
+    """
+    Bulk registry of serving counters sharing a single Redis quota hash.
+
+    Counter keys are the same as `ServingCounter.key`, but every quota lives in
+    one hash so a full resync is a single pipelined call, and remaining quotas
+    or increments for many UIDs cost one round trip instead of one per UID.
+
+    In "fixed_window" mode (the `ServingCounter` behaviour) a whole quota can be
+    spent right after a window opens. "token_bucket" mode refills quotas
+    continuously instead, so admissions are spread evenly over the interval.
+
+    `partitions` optionally splits every quota between traffic classes, such as
+    models, by share. Increments made for a partition may always use its share
+    of each quota, and may borrow the unused shares of other partitions except
+    for `protected_fraction` of them, so one class can never starve another.
+    Increments without a partition, or for an unknown one, are only bound by
+    the total quota.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        postfix_key: str = "",
+        mode: str = None,
+        partitions: dict[str, float] = None,
+        protected_fraction: float = 0.5,
+    ):
+        self.redis_client = redis_client
+        self.protected_fraction = protected_fraction
+        self.postfix_key = postfix_key
+        self.mode = mode or CONFIG.bandwidth.rate_limit_mode
+        if self.mode not in ("fixed_window", "token_bucket"):
+            raise ValueError(f"Unknown rate limit mode: {self.mode}")
+        self.quota_key = f"{CONFIG.redis.miner_manager_key}:{postfix_key}:quotas"
+        self.quotas: dict[int, int] = {}
+        self.partitions: dict[str, float] = {}
+        self.set_partitions(partitions or {})
+        self._increment_many = self.redis_client.register_script(
+            TOKEN_BUCKET_INCREMENT_MANY_SCRIPT
+            if self.mode == "token_bucket"
+            else INCREMENT_MANY_SCRIPT
+        )
+        self._token_bucket_remaining = self.redis_client.register_script(
+            TOKEN_BUCKET_REMAINING_SCRIPT
+        )
+        self._release = self.redis_client.register_script(RELEASE_SCRIPT)
+
+    def counter_key(self, uid: int) -> str:
+        key = f":{CONFIG.redis.miner_manager_key}:{self.postfix_key}:{uid}"
+        return f"{key}:bucket" if self.mode == "token_bucket" else key
+
+    def partition_key(self, uid: int, partition: str) -> str:
+        return f":{CONFIG.redis.miner_manager_key}:{self.postfix_key}:{uid}:partition:{partition}"
+
+    def set_partitions(self, partitions: dict[str, float]):
+        """Set the share of each partition. Shares are normalized to sum to 1."""
+        total = sum(share for share in partitions.values() if share > 0)
+        self.partitions = {
+            name: share / total for name, share in partitions.items() if share > 0
+        }
+
+    def _partition_keys(self, uid: int) -> list[str]:
+        return [self.partition_key(uid, name) for name in self.partitions]
+
+    def set_quotas(self, quotas: dict[int, int]):
+        """Replace every quota atomically in one pipelined transaction."""
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.delete(self.quota_key)
+        if quotas:
+            pipe.hset(self.quota_key, mapping=quotas)
+        pipe.execute()
+        self.quotas = dict(quotas)
+        logger.info(f"Installed {len(quotas)} quotas in {self.quota_key}")
+
+    def remaining(self, uids: list[int] = None) -> np.ndarray:
+        """Return the remaining quota of each UID, aligned with `uids`."""
+        uids = list(self.quotas) if uids is None else list(uids)
+        if not uids:
+            return np.zeros(0, dtype=np.int64)
+        if self.mode == "token_bucket":
+            remaining = self._token_bucket_remaining(
+                keys=[self.quota_key] + [self.counter_key(uid) for uid in uids],
+                args=[CONFIG.bandwidth.interval] + uids,
+            )
+            return np.array(remaining, dtype=np.int64)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hmget(self.quota_key, uids)
+        pipe.mget([self.counter_key(uid) for uid in uids])
+        quotas, counts = pipe.execute()
+        quotas = np.array([int(quota or 0) for quota in quotas], dtype=np.int64)
+        counts = np.array([int(count or 0) for count in counts], dtype=np.int64)
+        return np.maximum(quotas - counts, 0)
+
+    def increment_many(
+        self,
+        uids: list[int],
+        amount: int = 1,
+        ignore_threshold: float = None,
+        partition: str = None,
+    ) -> list[bool]:
+        """
+        Increment the counters of many UIDs in a single atomic call.
+
+        In "fixed_window" mode this applies the same rules as
+        `ServingCounter.increment` to each UID. In "token_bucket" mode a UID is
+        admitted when its bucket holds at least `amount` tokens. When
+        `partition` is a known partition, the UID must also have room for it
+        under the partition rules described on the class.
+
+        Returns:
+            list[bool]: Whether each UID was under its rate limit, aligned with `uids`
+        """
+        if not uids:
+            return []
+        names = list(self.partitions)
+        index = names.index(partition) + 1 if partition in self.partitions else 0
+        keys = [self.quota_key]
+        for uid in uids:
+            keys.append(self.counter_key(uid))
+            keys.extend(self._partition_keys(uid))
+        results = self._increment_many(
+            keys=keys,
+            args=[
+                amount,
+                -1 if ignore_threshold is None else ignore_threshold,
+                CONFIG.bandwidth.interval,
+                index,
+                len(names),
+                self.protected_fraction,
+            ]
+            + list(self.partitions.values())
+            + list(uids),
+        )
+        return [bool(result) for result in results]
+
+    def increment(
+        self,
+        uid: int,
+        amount: int = 1,
+        ignore_threshold: float = None,
+        partition: str = None,
+    ) -> bool:
+        return self.increment_many([uid], amount, ignore_threshold, partition)[0]
+
+    def partition_usage(self, uid: int) -> dict[str, int]:
+        """Return the credit each partition spent on the UID in the current window."""
+        if not self.partitions:
+            return {}
+        usage = self.redis_client.mget(self._partition_keys(uid))
+        return {name: int(used or 0) for name, used in zip(self.partitions, usage)}
+
+    # Reservation hash field holding the partition the credit was charged to
+    PARTITION_FIELD = "partition"
+
+    def _reserved_uids(self, key: str) -> list[int]:
+        return [
+            int(uid)
+            for uid in self.redis_client.hkeys(key)
+            if uid != self.PARTITION_FIELD.encode()
+        ]
+
+    def reservation_key(self, reservation_id: str) -> str:
+        return f"{CONFIG.redis.miner_manager_key}:{self.postfix_key}:reservation:{reservation_id}"
+
+    def reserve(
+        self,
+        reservation_id: str,
+        uids: list[int],
+        amount: int,
+        partition: str = None,
+    ):
+        """
+        Record credit already charged by `increment_many` as a pending reservation.
+
+        A reservation can then be committed, which keeps the charge, or released,
+        which refunds it. Reservations that are neither expire after one
+        interval and the charge stands. Pass the same `partition` as the
+        increment so a release also refunds the partition usage.
+        """
+        if not uids:
+            return
+        key = self.reservation_key(reservation_id)
+        mapping = {uid: amount for uid in uids}
+        if partition in self.partitions:
+            mapping[self.PARTITION_FIELD] = partition
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, CONFIG.bandwidth.interval)
+        pipe.execute()
+
+    def commit(self, reservation_id: str, uids: list[int] = None) -> list[int]:
+        """Keep the charge of pending reservations. Defaults to all UIDs."""
+        key = self.reservation_key(reservation_id)
+        if uids is None:
+            uids = self._reserved_uids(key)
+        if not uids:
+            return []
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hmget(key, uids)
+        pipe.hdel(key, *uids)
+        amounts, _ = pipe.execute()
+        return [uid for uid, amount in zip(uids, amounts) if amount is not None]
+
+    def release(self, reservation_id: str, uids: list[int] = None) -> dict[int, int]:
+        """
+        Refund pending reservations. Defaults to all UIDs.
+
+        Each reservation is refunded at most once and never pushes a counter
+        below zero. Counters whose window already expired are left untouched.
+
+        Returns:
+            dict[int, int]: Refunded amount per UID
+        """
+        key = self.reservation_key(reservation_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hget(key, self.PARTITION_FIELD)
+        pipe.hkeys(key)
+        partition, fields = pipe.execute()
+        if uids is None:
+            uids = [int(uid) for uid in fields if uid != self.PARTITION_FIELD.encode()]
+        if not uids:
+            return {}
+        partition = partition.decode() if partition else None
+        keys = [self.quota_key, key]
+        for uid in uids:
+            keys.append(self.counter_key(uid))
+            if partition:
+                keys.append(self.partition_key(uid, partition))
+        released = self._release(
+            keys=keys,
+            args=[self.mode, 2 if partition else 1] + list(uids),
+        )
+        return {
+            int(released[i]): int(released[i + 1]) for i in range(0, len(released), 2)
+        }
+
+    def __contains__(self, uid: int) -> bool:
+        return uid in self.quotas
+
+    def __len__(self):
+        return len(self.quotas)
+
+    def __repr__(self):
+        return f"ServingCounterRegistry(size={len(self)}, key={self.quota_key})"
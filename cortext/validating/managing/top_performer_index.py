@@ -0,0 +1,52 @@
+import bisect
+
+
+class TopPerformerIndex:
+    """
+    Ranked index of miners by accumulated score.
+
+    Entries are kept in a sorted array keyed by (-score, uid) so the best miners
+    are always at the front. Updating a single UID is a binary search plus one
+    insertion, which lets `MinerManager.step` keep the ranking current without
+    re-reading the whole metadata table on every organic request.
+    """
+
+    def __init__(self, min_score: float = 0.01):
+        self.min_score = min_score
+        self._entries: list[tuple[float, int]] = []
+        self._scores: dict[int, float] = {}
+
+    def rebuild(self, scores: dict[int, float]):
+        """Replace the index content with a fresh uid -> score mapping."""
+        self._scores = {
+            uid: score for uid, score in scores.items() if score > self.min_score
+        }
+        self._entries = sorted((-score, uid) for uid, score in self._scores.items())
+
+    def update(self, uid: int, score: float):
+        """Insert, move or drop a single UID according to its new score."""
+        self.remove(uid)
+        if score > self.min_score:
+            self._scores[uid] = score
+            bisect.insort(self._entries, (-score, uid))
+
+    def remove(self, uid: int):
+        old_score = self._scores.pop(uid, None)
+        if old_score is None:
+            return
+        index = bisect.bisect_left(self._entries, (-old_score, uid))
+        if index < len(self._entries) and self._entries[index] == (-old_score, uid):
+            del self._entries[index]
+
+    def top(self, n: int) -> list[tuple[int, float]]:
+        """Return the top N (uid, score) pairs in descending score order."""
+        return [(uid, -neg_score) for neg_score, uid in self._entries[:n]]
+
+    def score(self, uid: int) -> float:
+        return self._scores.get(uid, 0.0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"TopPerformerIndex(size={len(self)}, min_score={self.min_score})"
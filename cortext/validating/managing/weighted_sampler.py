@@ -0,0 +1,122 @@
+import random
+
+
+class FenwickSampler:
+    """
+    Dynamic weighted sampler backed by a Fenwick (binary indexed) tree.
+
+    Each key carries a non-negative weight (the remaining quota of a UID).
+    Setting a weight costs O(log n) and drawing k distinct keys with probability
+    proportional to their weights costs O(k log n), so callers can keep the
+    sampler in sync with counter changes instead of rebuilding a probability
+    vector for every batch.
+    """
+
+    def __init__(self, keys: list[int] = [], weights: list[float] = []):
+        self.rebuild(keys, weights)
+
+    def rebuild(self, keys: list[int], weights: list[float]):
+        """Replace all keys and weights in O(n)."""
+        if len(keys) != len(weights):
+            raise ValueError("keys and weights must have the same length")
+        self._keys = list(keys)
+        self._positions = {key: index for index, key in enumerate(self._keys)}
+        self._weights = [max(0, weight) for weight in weights]
+        size = len(self._keys)
+        self._tree = [0] * (size + 1)
+        for index, weight in enumerate(self._weights, start=1):
+            self._tree[index] += weight
+            parent = index + (index & -index)
+            if parent <= size:
+                self._tree[parent] += self._tree[index]
+        self._top_bit = 1 << (size.bit_length() - 1) if size else 0
+
+    def _add(self, position: int, delta: float):
+        index = position + 1
+        size = len(self._keys)
+        while index <= size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def _find(self, value: float) -> int:
+        """Return the position whose cumulative weight range contains value."""
+        position = 0
+        bit = self._top_bit
+        size = len(self._keys)
+        while bit:
+            next_position = position + bit
+            if next_position <= size and self._tree[next_position] <= value:
+                position = next_position
+                value -= self._tree[next_position]
+            bit >>= 1
+        return min(position, size - 1)
+
+    def set(self, key: int, weight: float):
+        """Set the weight of a key in O(log n). Unknown keys are ignored."""
+        position = self._positions.get(key)
+        if position is None:
+            return
+        weight = max(0, weight)
+        delta = weight - self._weights[position]
+        if delta:
+            self._weights[position] = weight
+            self._add(position, delta)
+
+    def weight(self, key: int) -> float:
+        position = self._positions.get(key)
+        return 0 if position is None else self._weights[position]
+
+    @property
+    def total(self) -> float:
+        total = 0
+        index = len(self._keys)
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    @property
+    def available(self) -> int:
+        """Number of keys with a positive weight."""
+        return sum(1 for weight in self._weights if weight > 0)
+
+    def sample(self, k: int, rng: random.Random = None) -> list[int]:
+        """
+        Draw up to k distinct keys with probability proportional to weight.
+
+        Picked keys are temporarily removed from the tree and restored before
+        returning, so the sampler state is unchanged by a call.
+
+        Args:
+            k (int): Number of keys to draw
+            rng (random.Random): Optional random source (default: module RNG)
+
+        Returns:
+            list[int]: Selected keys, fewer than k if not enough keys have weight
+        """
+        rng = rng or random
+        picked = []
+        removed = []
+        for _ in range(k):
+            total = self.total
+            if total <= 0:
+                break
+            position = self._find(rng.random() * total)
+            weight = self._weights[position]
+            if weight <= 0:
+                # Floating point drift landed on an empty slot; nothing left to draw.
+                break
+            picked.append(self._keys[position])
+            removed.append((position, weight))
+            self._weights[position] = 0
+            self._add(position, -weight)
+        for position, weight in removed:
+            self._weights[position] = weight
+            self._add(position, weight)
+        return picked
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"FenwickSampler(size={len(self)}, total={self.total})"
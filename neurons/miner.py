@@ -1,6 +1,6 @@
 from cortext import base, protocol, CONFIG, mining
-from cortext.utilities.rate_limit import get_rate_limit_proportion
-from cortext.validating.managing import ServingCounter
+from cortext.utilities.rate_limit import StakeTable
+from cortext.validating.managing import ServingCounterRegistry
 import bittensor as bt
 from typing import Tuple
 import time
@@ -18,6 +18,9 @@ class Miner(base.BaseMiner):
             base_url="https://api.anthropic.com/v1"
         )
         self.redis = redis.Redis(host=CONFIG.redis.host, port=CONFIG.redis.port)
+        self.rate_limits = ServingCounterRegistry(
+            redis_client=self.redis, postfix_key=self.axon.port
+        )
         self.uid = self.metagraph.hotkeys.index(self.wallet.hotkey.ss58_address)
 
     def _initialize_rate_limits(self):
@@ -25,30 +28,16 @@ class Miner(base.BaseMiner):
         Initializes the rate limits for the miners.
         """
 
-        S = self.metagraph.S
-        valid_stake_uids = [
-            uid for uid in range(len(S)) if S[uid] > CONFIG.bandwidth.min_stake
-        ]
+        stake_table = StakeTable.from_metagraph(self.metagraph)
         rate_limit_distribution = {
             uid: max(
-                int(
-                    get_rate_limit_proportion(metagraph=self.metagraph, uid=uid)
-                    * self.config.miner.total_credit
-                ),
+                int(stake_table.proportion(uid) * self.config.miner.total_credit),
                 2,
             )
-            for uid in valid_stake_uids
-        }
-        self.rate_limits = {
-            uid: ServingCounter(
-                quota=rate_limit,
-                uid=uid,
-                redis_client=self.redis,
-                postfix_key=self.axon.port,
-            )
-            for uid, rate_limit in rate_limit_distribution.items()
+            for uid in stake_table.eligible_uids()
         }
-        for uid, rate_limit in self.rate_limits.items():
+        self.rate_limits.set_quotas(rate_limit_distribution)
+        for uid, rate_limit in rate_limit_distribution.items():
             logger.info(f"Rate limit for {uid}: {rate_limit}")
         logger.info(f"Total credit: {self.config.miner.total_credit}")
 
@@ -59,7 +48,7 @@ class Miner(base.BaseMiner):
             try:
                 # Periodically update our knowledge of the network graph.
                 if step % 60 == 0:
-                    self.metagraph.sync()
+                    self.chain_sync()
                     self._initialize_rate_limits()
                     log = (
                         f"Block: {self.metagraph.block.item()} | "
@@ -135,7 +124,7 @@ class Miner(base.BaseMiner):
         if stake < CONFIG.bandwidth.min_stake:
             return True, "Stake too low."
         cost = CONFIG.bandwidth.model_configs[synapse.miner_payload.model].credit
-        allowed = self.rate_limits[uid].increment(amount=cost)
+        allowed = self.rate_limits.increment(uid, amount=cost)
         if not allowed:
             return True, "Rate limit exceeded."
         return False, ""
@@ -1,5 +1,6 @@
 from cortext import CONFIG, base, protocol
 from cortext.configs.bandwidth import ModelConfig
+from cortext.utilities.metagraph_snapshot import MetagraphSnapshotClient
 import bittensor as bt
 import httpx
 import asyncio
@@ -9,7 +10,11 @@ import time
 import numpy as np
 from redis.asyncio import Redis
 from typing import List, Dict, Optional, Tuple
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
+
+
+# Length in seconds of the epochs over which scored UIDs are counted
+SCORED_COUNTER_EPOCH = 360
 
 
 @dataclass
@@ -73,12 +78,89 @@ class ResponseProcessor:
         return valid, invalid
 
 
+class ScoreAggregator:
+    """Buffers score updates and sends them to the miner manager in bulk"""
+
+    def __init__(self, client: httpx.AsyncClient, max_size: int, max_delay: float):
+        self.client = client
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.steps: List[Dict] = []
+        self.size = 0
+        self.first_added_at: Optional[float] = None
+        # Serializes flushes so the manager applies steps in arrival order
+        self.lock = asyncio.Lock()
+
+    async def add(self, uids: List[int], scores: List[float]) -> None:
+        """Buffer one step, flushing when the buffer is full"""
+        if not uids:
+            return
+        self.steps.append({"scores": scores, "total_uids": uids})
+        self.size += len(uids)
+        if self.first_added_at is None:
+            self.first_added_at = time.monotonic()
+        if self.size >= self.max_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Send every buffered step in order with a single request"""
+        async with self.lock:
+            if not self.steps:
+                return
+            steps = self.steps
+            self.steps, self.size, self.first_added_at = [], 0, None
+            try:
+                result = await self.client.post(
+                    "/api/step_many", json={"steps": steps}, timeout=60.0
+                )
+                result.raise_for_status()
+                logger.info(f"Flushed {len(steps)} score updates")
+            except Exception as e:
+                logger.error(f"Error flushing {len(steps)} score updates: {str(e)}")
+                self._requeue(steps)
+
+    def _requeue(self, steps: List[Dict]) -> None:
+        """Put failed steps back ahead of newer ones, retried after `max_delay`"""
+        self.steps = steps + self.steps
+        self.size += sum(len(step["total_uids"]) for step in steps)
+        self.first_added_at = time.monotonic()
+        # Bound the buffer while the manager is down, oldest updates go first
+        dropped = 0
+        while self.size > 4 * self.max_size and len(self.steps) > 1:
+            self.size -= len(self.steps.pop(0)["total_uids"])
+            dropped += 1
+        if dropped:
+            logger.warning(f"Dropped {dropped} score updates the manager never applied")
+
+    async def run(self) -> None:
+        """Flush buffered steps once the oldest one is `max_delay` old"""
+        while True:
+            delay = self.max_delay
+            if self.first_added_at is not None:
+                delay -= time.monotonic() - self.first_added_at
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                await self.flush()
+
+
 class Validator(base.BaseValidator):
     def __init__(self):
         super().__init__()
         self._init_clients(ClientConfig())
         self.redis = Redis(host="localhost", port=6379, db=1)
+        # Tracking records are read by the miner manager from its own database
+        self.tracking_redis = Redis(
+            host=CONFIG.redis.host, port=CONFIG.redis.port, db=CONFIG.redis.db
+        )
         self.response_processor = ResponseProcessor()
+        # Time of the last weight update the scored counters were reset for
+        self.weights_set_at = 0.0
+        self.score_aggregator = ScoreAggregator(
+            self.miner_manager_client,
+            max_size=CONFIG.validating.score_flush_size,
+            max_delay=CONFIG.validating.score_flush_interval,
+        )
 
     def _init_clients(self, config: ClientConfig) -> None:
         """Initialize HTTP clients"""
@@ -86,11 +168,22 @@ class Validator(base.BaseValidator):
         self.synthesize_client = httpx.AsyncClient(base_url=config.synthesize_url)
         self.miner_manager_client = httpx.AsyncClient(base_url=config.miner_manager_url)
         self.w_subtensor_client = httpx.AsyncClient(base_url=config.w_subtensor_url)
+        self.metagraph_snapshots = MetagraphSnapshotClient(
+            self.w_subtensor_client,
+            max_age=CONFIG.w_subtensor.snapshot_max_age,
+            table_path=CONFIG.w_subtensor.table_path,
+        )
 
     async def run(self) -> None:
         """Main validator loop"""
         logger.info("Starting validator loop.")
         asyncio.create_task(self.periodically_set_weights())
+        asyncio.create_task(self.score_aggregator.run())
+        asyncio.create_task(
+            self.metagraph_snapshots.listen(
+                self.tracking_redis, CONFIG.redis.metagraph_channel
+            )
+        )
         await self.redis.flushdb()
 
         while not self.should_exit:
@@ -115,22 +208,34 @@ class Validator(base.BaseValidator):
 
     async def _update_weights(self) -> None:
         """Update network weights and handle scoring data"""
+        await self.score_aggregator.flush()
         scored_counter = await self.get_scored_counter()
         await self._log_scoring_statistics(scored_counter)
 
-        result = await self.w_subtensor_client.post("/api/set_weights", timeout=120)
-        result = result.json()
-        logger.info(f"Set weights result: {result}")
-
-        if result["success"]:
+        if CONFIG.w_subtensor.schedule_weights:
+            # The syncing service sets weights on its own schedule
+            status = await self.w_subtensor_client.get(
+                "/api/weights_status", timeout=10
+            )
+            status = status.json()
+            logger.info(f"Weight setting status: {status}")
+            success_at = status["last_success_at"]
+            success = success_at is not None and success_at > self.weights_set_at
+            if success:
+                self.weights_set_at = success_at
+        else:
+            result = await self.w_subtensor_client.post("/api/set_weights", timeout=120)
+            result = result.json()
+            logger.info(f"Set weights result: {result}")
+            success = result["success"]
+
+        if success:
             logger.info("Resetting scored_uids after setting weights successfully")
             await self.redis.flushdb()
 
     async def _log_scoring_statistics(self, scored_counter: Dict[int, int]) -> None:
         """Log statistics about scoring"""
-        logger.info(
-            f"Total scored: {len(await self.redis.keys('scored_uid:*'))} in this epoch"
-        )
+        logger.info(f"Total scored: {len(scored_counter)} in this epoch")
         scored_times = np.array(list(scored_counter.values()))
 
         if len(scored_times) > 0:
@@ -151,8 +256,9 @@ class Validator(base.BaseValidator):
         futures = []
         for _ in range(concurrent_batches):
             model_config = CONFIG.bandwidth.sample_model
+            reservation_id = None
             try:
-                uids = await self._get_miner_uids(
+                uids, reservation_id = await self._get_miner_uids(
                     model_config, batch_size, synthetic_threshold
                 )
                 if not uids:
@@ -160,10 +266,14 @@ class Validator(base.BaseValidator):
 
                 logger.info(f"Forwarding - {uids} - {model_config.model}")
                 synapse = await self.synthesize(model_config)
-                futures.append(self.process_batch(uids, synapse, model_config))
+                futures.append(
+                    self.process_batch(uids, synapse, model_config, reservation_id)
+                )
                 await asyncio.sleep(1)
             except Exception as e:
                 logger.error(f"Error in start_epoch: {str(e)}")
+                if reservation_id:
+                    await self._release_credit(reservation_id)
                 continue
 
         await asyncio.gather(*futures)
@@ -171,14 +281,15 @@ class Validator(base.BaseValidator):
 
     async def _get_miner_uids(
         self, model_config: ModelConfig, batch_size: int, threshold: float
-    ) -> Optional[List[int]]:
-        """Get UIDs of available miners"""
+    ) -> Tuple[List[int], str]:
+        """Get UIDs of available miners and the reservation holding their credit"""
         response = await self.miner_manager_client.post(
             "/api/consume",
             json={
                 "threshold": threshold,
                 "k": batch_size,
                 "task_credit": model_config.credit,
+                "model": model_config.model,
             },
         )
         response_json = response.json()
@@ -186,34 +297,61 @@ class Validator(base.BaseValidator):
 
         if not uids:
             logger.error("No miners found")
-        return uids
+        return uids, response_json["reservation_id"]
+
+    async def _commit_credit(self, reservation_id: str, uids: List[int]) -> None:
+        """Keep the credit reserved for miners that served the request"""
+        try:
+            await self.miner_manager_client.post(
+                "/api/commit",
+                json={"reservation_id": reservation_id, "uids": uids},
+            )
+        except Exception as e:
+            logger.error(f"Error committing credit: {str(e)}")
+
+    async def _release_credit(
+        self, reservation_id: str, uids: Optional[List[int]] = None
+    ) -> None:
+        """Return reserved credit of calls never sent, all pending UIDs by default"""
+        try:
+            await self.miner_manager_client.post(
+                "/api/release",
+                json={"reservation_id": reservation_id, "uids": uids},
+            )
+        except Exception as e:
+            logger.error(f"Error releasing credit: {str(e)}")
 
     async def process_batch(
         self,
         uids: List[int],
         synapse: protocol.ChatStreamingProtocol,
         model_config: ModelConfig,
+        reservation_id: str,
     ) -> None:
         """Process a batch of miners"""
         batch_id = f"batch_{int(time.time())}_{model_config.model}"
+        responses = []
         try:
             axons = await self._get_axons(uids)
             responses = await self.query_non_streaming(axons, synapse, model_config)
             logger.info(f"Received {len(responses)} responses")
-            await self.score(uids, responses, synapse, batch_id)
+            await self.score(uids, responses, synapse, batch_id, reservation_id)
         except Exception as e:
             traceback.print_exc()
             logger.error(f"Error in process_batch: {str(e)}")
+        finally:
+            # score() settles every UID it got a response for. Miners count a
+            # call once it reaches them, so the rest is only refunded when
+            # the batch was never sent.
+            if responses:
+                await self._commit_credit(reservation_id, uids)
+            else:
+                await self._release_credit(reservation_id)
 
     async def _get_axons(self, uids: List[int]) -> List[bt.AxonInfo]:
         """Get axon information for UIDs"""
-        axons_data = await self.w_subtensor_client.post(
-            "/api/axons",
-            json={"uids": uids},
-            timeout=4,
-        )
-        axons_data: List[str] = axons_data.json()["axons"]
-        return [bt.AxonInfo.from_string(axon_data) for axon_data in axons_data]
+        snapshot = await self.metagraph_snapshots.get()
+        return [snapshot.axon(uid) for uid in uids]
 
     async def query_non_streaming(
         self,
@@ -266,6 +404,7 @@ class Validator(base.BaseValidator):
         """Load and process streaming response"""
         try:
             start_time = time.time()
+            first_chunk_time = None
             streaming_chunks = []
             synapse = None
 
@@ -274,6 +413,8 @@ class Validator(base.BaseValidator):
                     synapse = chunk
                     continue
                 else:
+                    if first_chunk_time is None:
+                        first_chunk_time = time.time()
                     streaming_chunks.append(chunk)
             if len(streaming_chunks) < 0:
                 logger.error(
@@ -284,6 +425,8 @@ class Validator(base.BaseValidator):
             end_time = time.time()
             process_time = end_time - start_time
             synapse.dendrite.process_time = process_time
+            if first_chunk_time is not None:
+                synapse._time_to_first_token = first_chunk_time - start_time
 
             chunks_per_second = len(streaming_chunks) / process_time
             logger.success(
@@ -295,14 +438,15 @@ class Validator(base.BaseValidator):
             logger.error(f"Error in load_streaming_response: {str(e)}")
             return None
 
+    @staticmethod
+    def _scored_counter_key() -> str:
+        """Key of the hash counting scored UIDs in the current epoch"""
+        return f"scored_uid:{int(time.time() // SCORED_COUNTER_EPOCH)}"
+
     async def get_scored_counter(self) -> Dict[int, int]:
         """Get counter of scored UIDs"""
-        scored_counter = {}
-        async for key in self.redis.scan_iter("scored_uid:*"):
-            uid = int(key.decode().split(":")[1])
-            count = await self.redis.get(key)
-            scored_counter[uid] = int(count)
-        return scored_counter
+        scored_counter = await self.redis.hgetall(self._scored_counter_key())
+        return {int(uid): int(count) for uid, count in scored_counter.items()}
 
     async def score(
         self,
@@ -310,28 +454,52 @@ class Validator(base.BaseValidator):
         responses: List[protocol.ChatStreamingProtocol],
         base_request: protocol.ChatStreamingProtocol,
         batch_id: str,
+        reservation_id: Optional[str] = None,
     ) -> None:
         """Score miner responses"""
         valid_pairs, invalid_pairs = self.response_processor.validate_responses(
             uids, responses
         )
 
+        await self._report_results(valid_pairs, invalid_pairs)
+
+        if reservation_id:
+            # The miner's own rate limit already counted every call that reached
+            # it, so only calls that never did are refunded
+            unsent = [
+                uid
+                for uid, response, _ in invalid_pairs
+                if not response or not response.reached_miner
+            ]
+            await self._commit_credit(
+                reservation_id,
+                [uid for uid, _ in valid_pairs]
+                + [uid for uid, _, _ in invalid_pairs if uid not in unsent],
+            )
+            if unsent:
+                await self._release_credit(reservation_id, unsent)
+
         # Handle invalid responses
         if invalid_pairs:
             invalid_uids = [uid for uid, _, _ in invalid_pairs]
             await self._zero_invalid_miners(invalid_uids)
 
             # Track invalid responses
-            for uid, response, invalid_reason in invalid_pairs:
-                tracking_data = ResponseTrackingData(
-                    batch_id=batch_id,
-                    uid=uid,
-                    model=base_request.miner_payload.model,
-                    score=0.0,
-                    response_time=response.dendrite.process_time if response else 0,
-                    invalid_reason=invalid_reason,
-                )
-                await self._store_tracking_data(tracking_data)
+            await self._store_tracking_data(
+                [
+                    ResponseTrackingData(
+                        batch_id=batch_id,
+                        uid=uid,
+                        model=base_request.miner_payload.model,
+                        score=0.0,
+                        response_time=(
+                            (response.dendrite.process_time or 0) if response else 0
+                        ),
+                        invalid_reason=invalid_reason,
+                    )
+                    for uid, response, invalid_reason in invalid_pairs
+                ]
+            )
 
         # Process valid responses
         valid_uids = [uid for uid, _ in valid_pairs]
@@ -349,20 +517,40 @@ class Validator(base.BaseValidator):
             valid_uids_to_score, valid_responses, base_request, batch_id
         )
 
-    async def _zero_invalid_miners(self, invalid_uids: List[int]) -> None:
-        """Set scores to zero for invalid miners"""
+    async def _report_results(
+        self,
+        valid_pairs: List[Tuple[int, protocol.ChatStreamingProtocol]],
+        invalid_pairs: List[Tuple[int, protocol.ChatStreamingProtocol, str]],
+    ) -> None:
+        """Report call outcomes for the manager's rolling miner statistics"""
+        results = [
+            {
+                "uid": uid,
+                "success": True,
+                "response_time": response.dendrite.process_time,
+                "ttft": response.time_to_first_token,
+            }
+            for uid, response in valid_pairs
+        ] + [
+            {
+                "uid": uid,
+                "success": False,
+                "response_time": (
+                    (response.dendrite.process_time or 0) if response else 0
+                ),
+            }
+            for uid, response, _ in invalid_pairs
+        ]
         try:
-            result = await self.miner_manager_client.post(
-                "/api/step",
-                json={
-                    "scores": [0.0] * len(invalid_uids),
-                    "total_uids": invalid_uids,
-                },
-                timeout=60.0,
+            await self.miner_manager_client.post(
+                "/api/report_results", json={"results": results}
             )
-            result.raise_for_status()
         except Exception as e:
-            logger.error(f"Error zeroing invalid miners: {str(e)}")
+            logger.error(f"Error reporting results: {str(e)}")
+
+    async def _zero_invalid_miners(self, invalid_uids: List[int]) -> None:
+        """Set scores to zero for invalid miners"""
+        await self.score_aggregator.add(invalid_uids, [0.0] * len(invalid_uids))
 
     async def _process_valid_responses(
         self,
@@ -377,17 +565,20 @@ class Validator(base.BaseValidator):
             penalized_scores = self._apply_time_penalties(valid_responses, scores)
 
             # Track valid responses
-            for uid, response, score in zip(
-                valid_uids, valid_responses, penalized_scores
-            ):
-                tracking_data = ResponseTrackingData(
-                    batch_id=batch_id,
-                    uid=uid,
-                    model=base_request.miner_payload.model,
-                    score=score,
-                    response_time=response.dendrite.process_time,
-                )
-                await self._store_tracking_data(tracking_data)
+            await self._store_tracking_data(
+                [
+                    ResponseTrackingData(
+                        batch_id=batch_id,
+                        uid=uid,
+                        model=base_request.miner_payload.model,
+                        score=score,
+                        response_time=response.dendrite.process_time,
+                    )
+                    for uid, response, score in zip(
+                        valid_uids, valid_responses, penalized_scores
+                    )
+                ]
+            )
 
             logger.info(
                 f"model: {base_request.miner_payload.model} - uids: {valid_uids} - scores: {scores} - penalized_scores: {penalized_scores}"
@@ -440,37 +631,28 @@ class Validator(base.BaseValidator):
         scores: List[float],
     ) -> None:
         """Update miner scores in the manager"""
-        await self.miner_manager_client.post(
-            "/api/step",
-            json={
-                "scores": scores,
-                "total_uids": uids,
-            },
-        )
+        await self.score_aggregator.add(uids, scores)
 
     async def _update_scoring_records(self, uids: List[int]) -> None:
         """Update scoring records in Redis"""
+        key = self._scored_counter_key()
         pipe = self.redis.pipeline()
         for uid in uids:
-            key = f"scored_uid:{uid}"
-            pipe.incr(key)
-            pipe.expire(key, 360)
+            pipe.hincrby(key, uid, 1)
+        pipe.expire(key, SCORED_COUNTER_EPOCH * 2)
         await pipe.execute()
 
-    async def _store_tracking_data(self, data: ResponseTrackingData) -> None:
-        """Store response tracking data in Redis"""
-        key = f"tracking:{data.batch_id}:{data.uid}"
-        value = {
-            "batch_id": data.batch_id,
-            "uid": data.uid,
-            "model": data.model,
-            "score": data.score,
-            "response_time": data.response_time,
-            "invalid_reason": data.invalid_reason,
-            "timestamp": data.timestamp,
-        }
-        await self.redis.hmset(key, value)
-        await self.redis.expire(key, 86400)  # Expire after 24 hours
+    async def _store_tracking_data(self, records: List[ResponseTrackingData]) -> None:
+        """Append response tracking data to the stream reported by the miner manager"""
+        pipe = self.tracking_redis.pipeline(transaction=False)
+        for record in records:
+            pipe.xadd(
+                CONFIG.redis.tracking_key,
+                asdict(record),
+                maxlen=CONFIG.redis.tracking_max_len,
+                approximate=True,
+            )
+        await pipe.execute()
 
 
 if __name__ == "__main__":
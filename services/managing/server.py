@@ -1,15 +1,14 @@
 from cortext.validating.managing.miner_manager import MinerManager
 from cortext import CONFIG
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from loguru import logger
 import uvicorn
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
+import uuid
 
 
 miner_manager = MinerManager(
-    network=CONFIG.subtensor_network,
-    netuid=CONFIG.subtensor_netuid,
     wallet_name=CONFIG.wallet_name,
     wallet_hotkey=CONFIG.wallet_hotkey,
 )
@@ -26,6 +25,12 @@ class ConsumeRequest(BaseModel):
     threshold: float
     k: int
     task_credit: int
+    model: Optional[str] = None
+
+
+class ReservationRequest(BaseModel):
+    reservation_id: str
+    uids: Optional[List[int]] = None
 
 
 class StepRequest(BaseModel):
@@ -33,6 +38,21 @@ class StepRequest(BaseModel):
     total_uids: List[int]
 
 
+class StepManyRequest(BaseModel):
+    steps: List[StepRequest]
+
+
+class MinerResult(BaseModel):
+    uid: int
+    success: bool
+    response_time: float
+    ttft: Optional[float] = None
+
+
+class ResultsRequest(BaseModel):
+    results: List[MinerResult]
+
+
 class WeightsResponse(BaseModel):
     weights: List[float]
     uids: List[int]
@@ -42,12 +62,37 @@ class TopPerformersRequest(BaseModel):
     n: int
     task_credit: int
     threshold: float = 1.0
+    strategy: str = "score"
+    model: Optional[str] = None
+    # UIDs the caller already tried for this request
+    exclude: list[int] = []
 
 
 @app.post("/api/consume")
 async def consume(request: ConsumeRequest):
     logger.info(f"Consuming {request.task_credit} credit for {request.k} miners")
-    uids = miner_manager.consume(request.threshold, request.k, request.task_credit)
+    reservation_id = uuid.uuid4().hex
+    uids = miner_manager.consume(
+        request.threshold,
+        request.k,
+        request.task_credit,
+        reservation_id,
+        model=request.model,
+    )
+    return {"uids": uids, "reservation_id": reservation_id}
+
+
+@app.post("/api/commit")
+async def commit(request: ReservationRequest):
+    logger.info(f"Committing reservation {request.reservation_id}")
+    uids = miner_manager.commit(request.reservation_id, request.uids)
+    return {"uids": uids}
+
+
+@app.post("/api/release")
+async def release(request: ReservationRequest):
+    logger.info(f"Releasing reservation {request.reservation_id}")
+    uids = miner_manager.release(request.reservation_id, request.uids)
     return {"uids": uids}
 
 
@@ -62,6 +107,32 @@ async def step(request: StepRequest):
         return {"success": False}
 
 
+@app.post("/api/step_many")
+async def step_many(request: StepManyRequest):
+    logger.info(f"Stepping {len(request.steps)} batches of miners")
+    try:
+        miner_manager.step_many(
+            [(step.scores, step.total_uids) for step in request.steps]
+        )
+        return {"success": True}
+    except Exception as e:
+        logger.error(f"Error in step_many: {e}")
+        # Lets the validator retry the steps, none of them was applied
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/report_results")
+async def report_results(request: ResultsRequest):
+    logger.info(f"Recording {len(request.results)} miner results")
+    miner_manager.record_results([result.model_dump() for result in request.results])
+    return {"success": True}
+
+
+@app.get("/api/miner_stats")
+async def miner_stats():
+    return miner_manager.get_miner_stats()
+
+
 @app.get("/api/weights")
 async def weights():
     logger.info("Getting weights")
@@ -74,10 +145,17 @@ async def consume_top_performers(request: TopPerformersRequest):
     logger.info(
         f"Consuming {request.task_credit} credit for top {request.n} performers"
     )
+    reservation_id = uuid.uuid4().hex
     uids = miner_manager.consume_top_performers(
-        n=request.n, task_credit=request.task_credit, threshold=request.threshold
+        n=request.n,
+        task_credit=request.task_credit,
+        threshold=request.threshold,
+        reservation_id=reservation_id,
+        strategy=request.strategy,
+        model=request.model,
+        exclude=request.exclude,
     )
-    return {"uids": uids}
+    return {"uids": uids, "reservation_id": reservation_id}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+from datetime import datetime, timezone
+from typing import Optional
+
+# Resets the credits if the reset date has passed, then debits ARGV[1] if the
+# balance allows it. ARGV: amount, now, expected reset timestamp, next reset
+# timestamp, next reset date. The expected reset timestamp is the one the
+# caller derived the next reset from; a mismatch means its record is stale.
+# Returns {status, used credits, total credits, reset timestamp} where status
+# is 1 when debited, 0 on insufficient credits, -1 for an unknown key and -2
+# for a stale record.
+DEBIT_CREDITS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1}
+end
+local reset_at = redis.call('HGET', KEYS[1], 'credit_reset_at')
+if not reset_at then
+    reset_at = ARGV[3]
+end
+if reset_at ~= '' and tonumber(ARGV[2]) >= tonumber(reset_at) then
+    if reset_at ~= ARGV[3] then
+        return {-2}
+    end
+    redis.call('HSET', KEYS[1], 'used_credits', '0', 'credit_reset_at', ARGV[4],
+        'credit_reset_date', ARGV[5])
+    reset_at = ARGV[4]
+end
+local total = redis.call('HGET', KEYS[1], 'total_credits')
+local used = redis.call('HGET', KEYS[1], 'used_credits')
+if tonumber(total) - tonumber(used) < tonumber(ARGV[1]) then
+    return {0, used, total, reset_at}
+end
+if tonumber(ARGV[1]) > 0 then
+    used = redis.call('HINCRBYFLOAT', KEYS[1], 'used_credits', ARGV[1])
+end
+return {1, used, total, reset_at}
+"""
+
+
+def reset_timestamp(reset_date: Optional[datetime]) -> str:
+    if reset_date is None:
+        return ""
+    return str(int(reset_date.replace(tzinfo=timezone.utc).timestamp()))
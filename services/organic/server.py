@@ -1,10 +1,15 @@
-from datetime import datetime
+import asyncio
+import json
+from datetime import datetime, timezone
 from typing import Optional
 from pydantic import BaseModel, Field
 from decimal import Decimal
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from cortext import CONFIG, protocol
+from cortext.utilities.metagraph_snapshot import MetagraphSnapshotClient
+from cortext.validating.managing.miner_stats import DecayedQuantileSketch
+from .credits import DEBIT_CREDITS_SCRIPT, reset_timestamp
 from fastapi.responses import StreamingResponse
 import httpx
 import bittensor as bt
@@ -13,6 +18,7 @@ from redis.asyncio import Redis
 import uvicorn
 import secrets
 import os
+import time
 from dateutil.relativedelta import relativedelta
 import traceback
 from fastapi.middleware.cors import CORSMiddleware
@@ -35,6 +41,11 @@ wallet = bt.wallet(
 subtensor_client = httpx.AsyncClient(
     base_url=f"http://{CONFIG.w_subtensor.host}:{CONFIG.w_subtensor.port}"
 )
+metagraph_snapshots = MetagraphSnapshotClient(
+    subtensor_client,
+    max_age=CONFIG.w_subtensor.snapshot_max_age,
+    table_path=CONFIG.w_subtensor.table_path,
+)
 dendrite = bt.Dendrite(wallet=wallet)
 app = FastAPI()
 
@@ -59,6 +70,85 @@ class APIKey(BaseModel):
     credit_reset_date: Optional[datetime] = None  # For recurring credit allowance
 
 
+class APIKeyCache:
+    """
+    In-process cache of `APIKey` records.
+
+    Entries expire after `ttl` seconds. Every change to a key is published on
+    `CONFIG.redis.api_key_channel`, and `listen` drops the changed entries, so
+    other processes never serve a stale record for long.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # Identifies our own invalidations, which are applied locally already
+        self.origin = secrets.token_hex(8)
+        self.entries: dict[str, tuple[float, APIKey]] = {}
+
+    async def get(self, redis_client: Redis, key: str) -> Optional[APIKey]:
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        api_key = await get_api_key(redis_client, key)
+        if api_key is None:
+            self.entries.pop(key, None)
+        else:
+            self.put(api_key)
+        return api_key
+
+    def put(self, api_key: APIKey):
+        if len(self.entries) >= self.max_size:
+            now = time.monotonic()
+            self.entries = {
+                key: entry for key, entry in self.entries.items() if entry[0] > now
+            }
+            while len(self.entries) >= self.max_size:
+                self.entries.pop(next(iter(self.entries)))
+        self.entries[api_key.key] = (time.monotonic() + self.ttl, api_key)
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+    async def publish(self, redis_client: Redis, key: str):
+        await redis_client.publish(
+            CONFIG.redis.api_key_channel,
+            json.dumps({"key": key, "origin": self.origin}),
+        )
+
+    async def listen(self, redis_client: Redis):
+        """Drop keys changed by other processes, resubscribing after errors."""
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(CONFIG.redis.api_key_channel)
+                # Changes missed while unsubscribed are unknown
+                self.entries.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    change = json.loads(message["data"])
+                    if change["origin"] != self.origin:
+                        self.invalidate(change["key"])
+            except Exception as e:
+                logger.error(f"Error listening for API key changes: {e}")
+                self.entries.clear()
+            finally:
+                # Every attempt holds its own connection
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+
+api_key_cache = APIKeyCache(
+    ttl=CONFIG.organic.api_key_cache_ttl, max_size=CONFIG.organic.api_key_cache_size
+)
+
+
+@app.on_event("startup")
+async def start_api_key_listener():
+    asyncio.create_task(api_key_cache.listen(redis_client))
+
+
 async def store_api_key(redis_client: Redis, api_key: APIKey):
     await redis_client.hset(
         f"api_key:{api_key.key}",
@@ -74,8 +164,11 @@ async def store_api_key(redis_client: Redis, api_key: APIKey):
                 if api_key.credit_reset_date
                 else ""
             ),
+            "credit_reset_at": reset_timestamp(api_key.credit_reset_date),
         },
     )
+    api_key_cache.put(api_key)
+    await api_key_cache.publish(redis_client, api_key.key)
 
 
 async def get_api_key(redis_client: Redis, key: str) -> Optional[APIKey]:
@@ -98,22 +191,72 @@ async def get_api_key(redis_client: Redis, key: str) -> Optional[APIKey]:
     )
 
 
-async def update_credit_usage(redis_client: Redis, api_key: str, credits_used: Decimal):
-    key_data = await get_api_key(redis_client, api_key)
-    if key_data:
-        key_data.used_credits += credits_used
-        await store_api_key(redis_client, key_data)
+async def update_credit_usage(
+    redis_client: Redis, api_key: APIKey, credits_used: Decimal
+) -> Optional[Decimal]:
+    """
+    Reset the credits of `api_key` if due and debit `credits_used` in one
+    atomic call.
+
+    Returns:
+        Decimal: The remaining balance, or None if it does not cover
+            `credits_used` (or the key no longer exists).
+    """
+    for _ in range(2):
+        next_reset_date = (
+            calculate_next_reset_date(api_key.credit_reset_date)
+            if api_key.credit_reset_date
+            else None
+        )
+        result = await redis_client.eval(
+            DEBIT_CREDITS_SCRIPT,
+            1,
+            f"api_key:{api_key.key}",
+            str(credits_used),
+            int(datetime.utcnow().replace(tzinfo=timezone.utc).timestamp()),
+            reset_timestamp(api_key.credit_reset_date),
+            reset_timestamp(next_reset_date),
+            next_reset_date.isoformat() if next_reset_date else "",
+        )
+        status = result[0]
+        if status == -2:
+            # Another process reset the credits since this record was read
+            api_key_cache.invalidate(api_key.key)
+            api_key = await api_key_cache.get(redis_client, api_key.key)
+            if api_key is None:
+                return None
+            continue
+        if status == -1:
+            api_key_cache.invalidate(api_key.key)
+            return None
+
+        used_credits = Decimal(result[1].decode())
+        total_credits = Decimal(result[2].decode())
+        reset_at = result[3].decode()
+        api_key_cache.put(
+            api_key.model_copy(
+                update={
+                    "used_credits": used_credits,
+                    "total_credits": total_credits,
+                    "credit_reset_date": (
+                        datetime.utcfromtimestamp(int(reset_at)) if reset_at else None
+                    ),
+                }
+            )
+        )
+        await api_key_cache.publish(redis_client, api_key.key)
+        if status == 0:
+            return None
+        return total_credits - used_credits
+    return None
 
 
 async def verify_api_key(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     redis: Redis = Depends(lambda: redis_client),
 ):
-    logger.info(credentials)
     api_key = credentials.credentials  # Extract token from Bearer credentials
-    key_data = await get_api_key(redis, api_key)
-
-    logger.info(f"Key data: {key_data}")
+    key_data = await api_key_cache.get(redis, api_key)
 
     if not key_data or not key_data.is_active:
         raise HTTPException(
@@ -130,11 +273,10 @@ async def verify_api_key(
 
     # Check if credits need to be reset
     if key_data.credit_reset_date and datetime.utcnow() >= key_data.credit_reset_date:
-        key_data.used_credits = Decimal(0)
-        key_data.credit_reset_date = calculate_next_reset_date(
-            key_data.credit_reset_date
-        )
-        await store_api_key(redis, key_data)
+        await update_credit_usage(redis, key_data, Decimal(0))
+        key_data = await api_key_cache.get(redis, api_key)
+        if key_data is None:
+            raise HTTPException(status_code=401, detail="Invalid or inactive API key")
 
     # Check if enough credits are available
     remaining_credits = key_data.total_credits - key_data.used_credits
@@ -147,6 +289,20 @@ async def verify_api_key(
     return key_data
 
 
+# Time to first token of served organic requests, used for the hedging delay
+ttft_sketch = DecayedQuantileSketch(decay=0.05)
+
+
+def hedge_delay() -> float:
+    delay = (
+        ttft_sketch.quantile(CONFIG.organic.hedge_quantile)
+        or CONFIG.organic.hedge_initial_delay
+    )
+    return min(
+        max(delay, CONFIG.organic.hedge_min_delay), CONFIG.organic.hedge_max_delay
+    )
+
+
 async def chat_completions(
     request: protocol.MinerPayload, api_key: APIKey = Depends(verify_api_key)
 ):
@@ -163,28 +319,61 @@ async def chat_completions(
                 detail=f"Insufficient credits. Required: {required_credits}, Remaining: {remaining_credits}",
             )
 
-        async def get_next_uid():
+        async def get_next_uid(exclude: list[int] = None):
             response = await managing_client.post(
                 "/api/consume_top_performers",
                 json={
                     "n": 128,  # Get single best performer
                     "task_credit": required_credits,
                     "threshold": 1.0,
+                    "strategy": "latency",
+                    "model": request.model,
+                    "exclude": exclude or [],
                 },
             )
-            uids = response.json()["uids"]
-            return uids[0] if uids else None
+            response_json = response.json()
+            uids = response_json["uids"]
+            if not uids:
+                return None, None
+            return uids[0], response_json["reservation_id"]
+
+        async def report_result(
+            uid: int, success: bool, response_time: float, ttft: float = None
+        ):
+            try:
+                await managing_client.post(
+                    "/api/report_results",
+                    json={
+                        "results": [
+                            {
+                                "uid": uid,
+                                "success": success,
+                                "response_time": response_time,
+                                "ttft": ttft,
+                            }
+                        ]
+                    },
+                    timeout=4,
+                )
+            except Exception as e:
+                logger.error(f"Error reporting result for UID {uid}: {e}")
 
-        async def try_uid(uid):
+        async def settle_credit(path: str, reservation_id: str):
+            # Commit the credit of miners the call reached, release it otherwise
             try:
-                axon_data = await subtensor_client.post(
-                    "/api/axons", timeout=4, json={"uids": [uid]}
+                await managing_client.post(
+                    path, json={"reservation_id": reservation_id}, timeout=4
                 )
-                axon_data: list[str] = axon_data.json()["axons"]
-                if not axon_data:
+            except Exception as e:
+                logger.error(f"Error calling {path} for {reservation_id}: {e}")
+
+        async def try_uid(uid):
+            try:
+                snapshot = await metagraph_snapshots.get()
+                if uid >= len(snapshot):
                     return None
 
-                axon = bt.AxonInfo.from_string(axon_data[0])
+                axon = snapshot.axon(uid)
                 logger.info(f"Forwarding request to {axon}")
                 responses = await dendrite.forward(
                     axons=[axon], synapse=synapse, streaming=True, timeout=64
@@ -199,38 +388,139 @@ async def chat_completions(
             miner_payload=request,
         )
 
-        # Try up to 3 times with different UIDs
-        response = None
-        max_retries = 3
-        for _ in range(max_retries):
-            uid = await get_next_uid()
-            if not uid:
-                raise HTTPException(
-                    status_code=500,
-                    detail="No top performing miners found",
-                )
+        # UIDs whose call went out. Their miners counted it against their own
+        # limit whatever the outcome, so only the other reservations are refunded.
+        sent: set[int] = set()
+
+        async def settle_attempt(uid: int, reservation_id: str):
+            path = "/api/commit" if uid in sent else "/api/release"
+            await settle_credit(path, reservation_id)
 
+        async def first_token(uid):
+            """Open a stream to `uid` and wait for its first response chunk."""
             response = await try_uid(uid)
-            if response is not None:
-                break
-            logger.warning(f"UID {uid} failed to respond, trying next miner...")
+            if response is None:
+                return None
+            sent.add(uid)
+            result = None
+            try:
+                async for chunk in response:
+                    if isinstance(chunk, protocol.MinerResponse):
+                        result = response, chunk
+                        break
+                    if (
+                        isinstance(chunk, protocol.ChatStreamingProtocol)
+                        and not chunk.reached_miner
+                    ):
+                        sent.discard(uid)
+            except Exception as e:
+                logger.error(f"Error with UID {uid}: {e}")
+            finally:
+                # Also closes the stream of a cancelled attempt
+                if result is None:
+                    await response.aclose()
+            return result
+
+        # Up to 3 miners with different UIDs. With hedging, the next miner
+        # starts when no token arrived in time, and the first token wins.
+        max_attempts = 3
+        attempts: dict[asyncio.Task, tuple[int, str, float]] = {}
+        # Running and failed UIDs, so a hedge never lands on the same miner
+        tried: set[int] = set()
+        launched = 0
+        exhausted = False
+        winner = None
+
+        async def launch() -> bool:
+            nonlocal launched, exhausted
+            uid, reservation_id = await get_next_uid(sorted(tried))
+            if uid is None:
+                exhausted = True
+                return False
+            tried.add(uid)
+            launched += 1
+            task = asyncio.create_task(first_token(uid))
+            attempts[task] = (uid, reservation_id, time.time())
+            return True
+
+        try:
+            while winner is None:
+                if not attempts:
+                    if launched >= max_attempts or exhausted or not await launch():
+                        break
+                can_hedge = launched < max_attempts and not exhausted
+                done, _ = await asyncio.wait(
+                    attempts,
+                    timeout=hedge_delay()
+                    if CONFIG.organic.hedge and can_hedge
+                    else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    logger.info("No token in time, hedging with another miner")
+                    await launch()
+                    continue
+                for task in done:
+                    uid, reservation_id, start_time = attempts.pop(task)
+                    result = task.result()
+                    if result is not None and winner is None:
+                        ttft = time.time() - start_time
+                        winner = uid, reservation_id, start_time, *result
+                    elif result is not None:
+                        # Lost a tie with the winner
+                        await result[0].aclose()
+                        await settle_attempt(uid, reservation_id)
+                    else:
+                        await settle_attempt(uid, reservation_id)
+                        await report_result(uid, False, time.time() - start_time)
+                        logger.warning(
+                            f"UID {uid} failed to respond, trying next miner..."
+                        )
+        finally:
+            # Cancel the losers, their streams close as the tasks unwind. This
+            # also runs when picking a hedge fails, so no reservation leaks.
+            for task in attempts:
+                task.cancel()
+            await asyncio.gather(
+                *(
+                    settle_attempt(uid, reservation_id)
+                    for uid, reservation_id, _ in attempts.values()
+                )
+            )
 
-        if response is None:
+        if winner is None:
             raise HTTPException(
                 status_code=500,
-                detail="All attempted miners failed to respond",
+                detail=(
+                    "No top performing miners found"
+                    if launched == 0
+                    else "All attempted miners failed to respond"
+                ),
             )
+        uid, reservation_id, start_time, response, first_chunk = winner
+        ttft_sketch.update(ttft)
 
         # Update credit usage only after successful response
-        await update_credit_usage(redis_client, api_key.key, Decimal(required_credits))
+        remaining_credits = await update_credit_usage(
+            redis_client, api_key, Decimal(required_credits)
+        )
+        if remaining_credits is None:
+            await response.aclose()
+            # The miner already served the first token
+            await settle_credit("/api/commit", reservation_id)
+            raise HTTPException(status_code=403, detail="Insufficient credits")
 
         async def stream_response():
             try:
+                yield f"data: {first_chunk.model_dump_json()}\n\n"
                 async for chunk in response:
                     if not isinstance(chunk, protocol.MinerResponse):
                         continue
                     yield f"data: {chunk.model_dump_json()}\n\n"
                 yield "data: [DONE]\n\n"
+                await report_result(
+                    uid, ttft is not None, time.time() - start_time, ttft
+                )
                 await redis_client.rpush(
                     CONFIG.redis.organic_queue_key, request.model_dump_json()
                 )
@@ -241,6 +531,9 @@ async def chat_completions(
                     "error": {"message": str(e), "type": "streaming_error"}
                 }
                 yield f"data: {error_response}\n\n"
+            finally:
+                # Keeps the miner counted as in flight until the stream ends
+                await settle_credit("/api/commit", reservation_id)
 
         return StreamingResponse(
             stream_response(),
@@ -309,13 +602,14 @@ async def add_credits(
             status_code=403, detail="Admin API key required for this operation"
         )
 
-    key_data = await get_api_key(redis_client, key)
-    if not key_data:
+    if not await redis_client.exists(f"api_key:{key}"):
         raise HTTPException(status_code=404, detail="API key not found")
 
-    key_data.total_credits += Decimal(amount)
-    await store_api_key(redis_client, key_data)
-    return key_data
+    # Incremented in place, so concurrent debits of the key are not lost
+    await redis_client.hincrbyfloat(f"api_key:{key}", "total_credits", amount)
+    api_key_cache.invalidate(key)
+    await api_key_cache.publish(redis_client, key)
+    return await api_key_cache.get(redis_client, key)
 
 
 @app.get("/api/v1/keys", response_model=list[APIKey])
@@ -351,7 +645,9 @@ async def update_key_status(
         raise HTTPException(status_code=404, detail="API key not found")
 
     key_data.is_active = status_update.get("is_active", key_data.is_active)
-    await store_api_key(redis_client, key_data)
+    await redis_client.hset(f"api_key:{key}", "is_active", str(key_data.is_active))
+    api_key_cache.put(key_data)
+    await api_key_cache.publish(redis_client, key)
     return key_data
 
 
@@ -366,6 +662,8 @@ async def delete_key(
         )
 
     deleted = await redis_client.delete(f"api_key:{key}")
+    api_key_cache.invalidate(key)
+    await api_key_cache.publish(redis_client, key)
     if not deleted:
         raise HTTPException(status_code=404, detail="API key not found")
 
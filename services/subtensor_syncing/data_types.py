@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 
 class UIDsRequest(BaseModel):
@@ -26,6 +26,16 @@ class RateLimitResponse(BaseModel):
     rate_limit_percentage: float
 
 
+class RateLimitsRequest(BaseModel):
+    # All UIDs when omitted
+    uids: Optional[List[int]] = None
+
+
+class RateLimitsResponse(BaseModel):
+    uids: List[int]
+    rate_limit_percentages: List[float]
+
+
 class SetWeightsResponse(BaseModel):
     success: bool
     message: str
@@ -1,58 +1,154 @@
+import asyncio
 import bittensor as bt
+import functools
 from loguru import logger
 from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 from cortext import CONFIG
 import httpx
 import traceback
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request, Response
 import uvicorn
 import numpy as np
-from cortext.utilities.rate_limit import get_rate_limit_proportion
+from cortext.utilities.rate_limit import StakeTable
+from cortext.utilities.metagraph_snapshot import MetagraphSnapshot
+from cortext.utilities.metagraph_table import MetagraphTable
+from cortext.utilities.metagraph_cache import MetagraphCache
+import json
+import os
+import redis
 from .data_types import (
     UIDsResponse,
     AxonsRequest,
     AxonsResponse,
     RateLimitRequest,
     RateLimitResponse,
+    RateLimitsRequest,
+    RateLimitsResponse,
     SetWeightsResponse,
 )
 
 
+# Seconds per block on the subtensor chain
+BLOCK_TIME = 12
+
+
 class AutoSyncSubtensor:
     def __init__(self):
         self.subtensor = bt.Subtensor(network=CONFIG.subtensor_network)
-        self.metagraph = self.subtensor.metagraph(CONFIG.subtensor_netuid)
         self.netuid = CONFIG.subtensor_netuid
+        self.metagraph_cache = MetagraphCache(
+            self.subtensor,
+            self.netuid,
+            os.path.join(
+                CONFIG.w_subtensor.metagraph_cache_dir, f"w_subtensor_{self.netuid}.pkl"
+            ),
+        )
+        self.metagraph = self.metagraph_cache.get()
         self.wallet = bt.wallet(name=CONFIG.wallet_name, hotkey=CONFIG.wallet_hotkey)
         self.miner_manager_client = httpx.AsyncClient(
             base_url=f"http://{CONFIG.miner_manager.host}:{CONFIG.miner_manager.port}",
         )
         self.uid = 0
+        self.redis_client = redis.Redis(
+            host=CONFIG.redis.host, port=CONFIG.redis.port, db=CONFIG.redis.db
+        )
+        self.snapshot: MetagraphSnapshot = None
+        try:
+            self.table = MetagraphTable.create(CONFIG.w_subtensor.table_path)
+        except OSError as e:
+            logger.warning(f"Shared metagraph table disabled: {e}")
+            self.table = None
+        self._publish_snapshot()
         self.sync_executor = ThreadPoolExecutor(max_workers=1)
         self.set_weights_executor = ThreadPoolExecutor(max_workers=1)
+        self.sync_lock = threading.Lock()
+        self.weights_task: asyncio.Task = None
+        self.weights_status = {
+            "last_update_block": int(self.metagraph.last_update[self.uid]),
+            "current_block": self.metagraph.block.item(),
+            "last_attempt_at": None,
+            "last_success_at": None,
+            "last_message": None,
+        }
         self.sync_executor.submit(self.sync_subtensor)
         self.router = APIRouter()
         self.router.add_api_route(
             "/api/set_weights", self.do_set_weights, methods=["POST"]
         )
+        self.router.add_api_route(
+            "/api/weights_status", self.get_weights_status, methods=["GET"]
+        )
         self.router.add_api_route("/api/axons", self.get_axons, methods=["POST"])
         self.router.add_api_route("/api/uids", self.get_uids, methods=["POST"])
+        self.router.add_api_route("/api/metagraph", self.get_metagraph, methods=["GET"])
         self.router.add_api_route(
             "/api/rate_limit_percentage",
             self.get_rate_limit_percentage,
             methods=["POST"],
         )
+        self.router.add_api_route(
+            "/api/rate_limit_percentages",
+            self.get_rate_limit_percentages,
+            methods=["POST"],
+        )
 
         self.app = FastAPI()
         self.app.include_router(self.router)
+        self.app.add_event_handler("startup", self._start_weight_scheduler)
+
+    async def _start_weight_scheduler(self):
+        if CONFIG.w_subtensor.schedule_weights:
+            asyncio.create_task(self.run_weight_scheduler())
 
     def sync_subtensor(self):
         while True:
             logger.info("Syncing subtensor")
-            self.metagraph.sync()
+            try:
+                self._sync_metagraph()
+            except Exception as e:
+                logger.error(f"Error syncing subtensor: {e}")
             time.sleep(600)
 
+    def _sync_metagraph(self):
+        """Refresh and publish the metagraph, one writer at a time."""
+        with self.sync_lock:
+            self.metagraph_cache.refresh()
+            self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        """
+        Serialize the metagraph once per sync for `/api/metagraph`, and push
+        what changed since the previous sync to subscribers.
+        """
+        snapshot = MetagraphSnapshot.from_metagraph(self.metagraph)
+        previous = self.snapshot
+        self.snapshot_body = json.dumps(snapshot.to_dict())
+        self.snapshot = snapshot
+        self.stake_table = StakeTable(snapshot.stakes)
+        if self.table is not None:
+            self.table.write(snapshot)
+        logger.info(f"Published {snapshot}")
+        if previous is None or previous.version == snapshot.version:
+            return
+        diff = snapshot.diff(previous)
+        try:
+            self.redis_client.publish(CONFIG.redis.metagraph_channel, json.dumps(diff))
+            logger.info(f"Pushed changes of {len(diff['changes'])} UIDs")
+        except Exception as e:
+            logger.error(f"Error pushing metagraph changes: {e}")
+
+    def get_metagraph(self, request: Request) -> Response:
+        etag = f'"{self.snapshot.version}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(
+            content=self.snapshot_body,
+            media_type="application/json",
+            headers={"ETag": etag},
+        )
+
     def get_uids(self) -> UIDsResponse:
         return UIDsResponse(uids=self.metagraph.uids.tolist())
 
@@ -62,15 +158,97 @@ class AutoSyncSubtensor:
 
     def get_rate_limit_percentage(self, request: RateLimitRequest) -> RateLimitResponse:
         return RateLimitResponse(
-            rate_limit_percentage=get_rate_limit_proportion(self.metagraph, request.uid)
+            rate_limit_percentage=self.stake_table.proportion(request.uid)
+        )
+
+    def get_rate_limit_percentages(
+        self, request: RateLimitsRequest
+    ) -> RateLimitsResponse:
+        if request.uids is None:
+            return RateLimitsResponse(
+                uids=list(range(len(self.stake_table))),
+                rate_limit_percentages=self.stake_table.proportions.tolist(),
+            )
+        return RateLimitsResponse(
+            uids=request.uids,
+            rate_limit_percentages=[
+                self.stake_table.proportion(uid) for uid in request.uids
+            ],
+        )
+
+    async def _run_chain_call(self, func, *args, **kwargs):
+        """Run a blocking chain call on the weight-setting thread."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.set_weights_executor, functools.partial(func, *args, **kwargs)
         )
 
+    async def run_weight_scheduler(self):
+        """
+        Set weights as soon as the tempo since the last update has passed.
+
+        The scheduler sleeps until the block at which weights may be set again,
+        estimated from the last known block, instead of polling blindly.
+        Consecutive failures back off exponentially up to 600 seconds.
+        """
+        failures = 0
+        while True:
+            try:
+                current_block = await self._run_chain_call(
+                    self.subtensor.get_current_block
+                )
+                self.weights_status["current_block"] = current_block
+                next_block = self._next_weights_block()
+                if current_block >= next_block:
+                    response = await self.set_weights()
+                    failures = 0 if response.success else failures + 1
+                    delay = BLOCK_TIME * 2**failures
+                else:
+                    delay = (next_block - current_block) * BLOCK_TIME
+            except Exception as e:
+                logger.error(f"Error in weight scheduler: {e}")
+                delay = 60
+            await asyncio.sleep(min(delay, 600))
+
+    def _last_update_block(self) -> int:
+        # The metagraph may be older than our own last successful update
+        return max(
+            self.weights_status["last_update_block"],
+            int(self.metagraph.last_update[self.uid]),
+        )
+
+    def _next_weights_block(self) -> int:
+        return self._last_update_block() + CONFIG.subtensor_tempo + 1
+
+    async def set_weights(self) -> SetWeightsResponse:
+        """Set weights, or wait for the attempt already in progress."""
+        if self.weights_task is None or self.weights_task.done():
+            self.weights_task = asyncio.create_task(self._set_weights())
+        return await asyncio.shield(self.weights_task)
+
     async def do_set_weights(self) -> SetWeightsResponse:
+        return await self.set_weights()
+
+    async def get_weights_status(self) -> dict:
+        return {
+            **self.weights_status,
+            "next_block": self._next_weights_block(),
+            "running": self.weights_task is not None and not self.weights_task.done(),
+        }
+
+    async def _set_weights(self) -> SetWeightsResponse:
         logger.info("Setting weights")
-        current_block = self.subtensor.get_current_block()
-        last_update = self.metagraph.last_update[self.uid]
+        current_block = await self._run_chain_call(self.subtensor.get_current_block)
+        last_update = self._last_update_block()
+        self.weights_status["current_block"] = current_block
         logger.info(f"Current block: {current_block}")
         logger.info(f"Last update: {last_update}")
+        if current_block <= last_update + CONFIG.subtensor_tempo:
+            logger.info(
+                f"Not setting weights because current block {current_block} is not greater than last update {last_update} + tempo {CONFIG.subtensor_tempo}"
+            )
+            return SetWeightsResponse(success=False, message="Not setting weights")
+
         logger.info("Getting weights from miner manager")
         response = await self.miner_manager_client.get("/api/weights", timeout=120)
         response_json = response.json()
@@ -86,6 +264,31 @@ class AutoSyncSubtensor:
             logger.info(f"Flat weights: {weights}")
         else:
             logger.info("Setting normal weights")
+
+        self.weights_status["last_attempt_at"] = time.time()
+        try:
+            success, msg = await asyncio.wait_for(
+                self._run_chain_call(self._submit_weights, uids, weights),
+                timeout=120,
+            )
+        except Exception as e:
+            logger.error(f"Failed to set weights: {e}")
+            traceback.print_exc()
+            self.weights_status["last_message"] = str(e)
+            return SetWeightsResponse(success=False, message=str(e))
+
+        self.weights_status["last_message"] = msg
+        if not success:
+            logger.error(f"Failed to set weights: {msg}")
+            await self._run_chain_call(self._sync_metagraph)
+            return SetWeightsResponse(success=False, message=msg)
+        logger.info(f"Set weights result: {success}")
+        self.weights_status["last_update_block"] = current_block
+        self.weights_status["last_success_at"] = time.time()
+        return SetWeightsResponse(success=True, message=msg)
+
+    def _submit_weights(self, uids: list[int], weights: list[float]):
+        """Process and submit weights. Blocking, runs on the weight-setting thread."""
         (
             processed_weight_uids,
             processed_weights,
@@ -103,35 +306,15 @@ class AutoSyncSubtensor:
             uids=processed_weight_uids, weights=processed_weights
         )
         logger.info(f"Setting weights for {self.uid}")
-        logger.info(f"Current block: {current_block}")
-        if current_block > last_update + CONFIG.subtensor_tempo:
-            logger.info(f"UIDs: {uint_uids}")
-            logger.info(f"Weights: {uint_weights}")
-            try:
-                future = self.set_weights_executor.submit(
-                    self.subtensor.set_weights,
-                    netuid=self.netuid,
-                    wallet=self.wallet,
-                    uids=uint_uids,
-                    weights=uint_weights,
-                    version_key=CONFIG.weight_version,
-                )
-                success, msg = future.result(timeout=120)
-                if not success:
-                    logger.error(f"Failed to set weights: {msg}")
-                    self.metagraph.sync()
-                    return SetWeightsResponse(success=False, message=msg)
-                else:
-                    logger.info(f"Set weights result: {success}")
-                    return SetWeightsResponse(success=True, message=msg)
-            except Exception as e:
-                logger.error(f"Failed to set weights: {e}")
-                traceback.print_exc()
-        else:
-            logger.info(
-                f"Not setting weights because current block {current_block} is not greater than last update {last_update} + tempo {CONFIG.subtensor_tempo}"
-            )
-            return SetWeightsResponse(success=False, message="Not setting weights")
+        logger.info(f"UIDs: {uint_uids}")
+        logger.info(f"Weights: {uint_weights}")
+        return self.subtensor.set_weights(
+            netuid=self.netuid,
+            wallet=self.wallet,
+            uids=uint_uids,
+            weights=uint_weights,
+            version_key=CONFIG.weight_version,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+from cortext.utilities.metagraph_cache import MetagraphCache
+import numpy as np
+
+
+class StubMetagraph:
+    def __init__(self, block: int, subtensor):
+        self.block = np.array([block])
+        self.hotkeys = [f"hotkey-{block}-{uid}" for uid in range(4)]
+        self.subtensor = subtensor
+
+
+class StubSubtensor:
+    def __init__(self):
+        self.block = 100
+        self.calls = 0
+
+    def metagraph(self, netuid: int) -> StubMetagraph:
+        self.calls += 1
+        return StubMetagraph(self.block, self)
+
+
+def test_cold_start_fetches_and_saves(tmp_path):
+    subtensor = StubSubtensor()
+    path = str(tmp_path / "cache" / "metagraph.pkl")
+    metagraph = MetagraphCache(subtensor, 18, path).get()
+    assert subtensor.calls == 1
+    assert metagraph.block.item() == 100
+    assert (tmp_path / "cache" / "metagraph.pkl").exists()
+
+
+def test_warm_start_skips_chain(tmp_path):
+    path = str(tmp_path / "metagraph.pkl")
+    MetagraphCache(StubSubtensor(), 18, path).get()
+
+    subtensor = StubSubtensor()
+    metagraph = MetagraphCache(subtensor, 18, path).get()
+    assert subtensor.calls == 0
+    assert metagraph.hotkeys[0] == "hotkey-100-0"
+    assert metagraph.subtensor is subtensor
+
+
+def test_refresh_updates_in_place(tmp_path):
+    subtensor = StubSubtensor()
+    cache = MetagraphCache(subtensor, 18, str(tmp_path / "metagraph.pkl"))
+    metagraph = cache.get()
+    subtensor.block = 101
+    cache.refresh()
+    assert metagraph.block.item() == 101
+    assert MetagraphCache(subtensor, 18, cache.path).load().block.item() == 101
+
+
+def test_corrupt_cache_is_ignored(tmp_path):
+    path = tmp_path / "metagraph.pkl"
+    path.write_bytes(b"not a pickle")
+    subtensor = StubSubtensor()
+    metagraph = MetagraphCache(subtensor, 18, str(path)).get()
+    assert subtensor.calls == 1
+    assert metagraph.block.item() == 100
@@ -0,0 +1,70 @@
+from cortext.utilities.metagraph_snapshot import MetagraphSnapshot
+from cortext.utilities.metagraph_table import MetagraphTable
+import pytest
+
+
+def make_snapshot(size: int, stake: float = 1.0) -> MetagraphSnapshot:
+    return MetagraphSnapshot(
+        block=100,
+        uids=list(range(size)),
+        hotkeys=[f"hotkey-{uid}" for uid in range(size)],
+        stakes=[stake * uid for uid in range(size)],
+        axons=[
+            {
+                "version": 1,
+                "ip": f"10.0.0.{uid}",
+                "port": 8000 + uid,
+                "ip_type": 4,
+                "hotkey": f"hotkey-{uid}",
+                "coldkey": f"coldkey-{uid}",
+                "protocol": 4,
+                "placeholder1": 0,
+                "placeholder2": 0,
+            }
+            for uid in range(size)
+        ],
+    )
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "metagraph")
+    writer = MetagraphTable.create(path, capacity=8)
+    snapshot = make_snapshot(4)
+    writer.write(snapshot)
+
+    reader = MetagraphTable.open(path)
+    loaded = MetagraphSnapshot.from_table(reader)
+    assert loaded.to_dict() == snapshot.to_dict()
+    assert loaded.axon(2).port == 8002
+
+
+def test_reader_follows_writer(tmp_path):
+    path = str(tmp_path / "metagraph")
+    writer = MetagraphTable.create(path, capacity=8)
+    writer.write(make_snapshot(4))
+    reader = MetagraphTable.open(path)
+    sequence = reader.sequence
+
+    writer.write(make_snapshot(6, stake=2.0))
+    assert reader.sequence == sequence + 2
+    _, _, _, records = reader.read()
+    assert len(records) == 6
+    assert records["stake"].tolist() == [0.0, 2.0, 4.0, 6.0, 8.0, 10.0]
+
+
+def test_read_waits_for_writer(tmp_path):
+    path = str(tmp_path / "metagraph")
+    writer = MetagraphTable.create(path, capacity=8)
+    writer.write(make_snapshot(4))
+    # Leave the sequence odd, as if the writer died halfway
+    writer._set_sequence(writer.sequence + 1)
+    with pytest.raises(TimeoutError):
+        MetagraphTable.open(path).read(timeout=0.05)
+
+    writer.write(make_snapshot(2))
+    assert writer.sequence % 2 == 0
+    assert len(MetagraphTable.open(path).read()[3]) == 2
+
+
+def test_open_missing_table(tmp_path):
+    assert MetagraphTable.open(str(tmp_path / "missing")) is None
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+from services.organic.credits import DEBIT_CREDITS_SCRIPT, reset_timestamp
+import asyncio
+import fakeredis
+import time
+
+KEY = "api_key:sk-test"
+
+
+def store(redis_client, used: str, reset_date: datetime = None, legacy=False):
+    mapping = {
+        "total_credits": "10",
+        "used_credits": used,
+        "credit_reset_date": reset_date.isoformat() if reset_date else "",
+    }
+    if not legacy:
+        mapping["credit_reset_at"] = reset_timestamp(reset_date)
+    redis_client.hset(KEY, mapping=mapping)
+
+
+def debit_args(amount, reset_date: datetime = None, next_reset_date: datetime = None):
+    return [
+        str(amount),
+        int(time.time()),
+        reset_timestamp(reset_date),
+        reset_timestamp(next_reset_date),
+        next_reset_date.isoformat() if next_reset_date else "",
+    ]
+
+
+def debit(redis_client, amount, reset_date=None, next_reset_date=None):
+    return redis_client.eval(
+        DEBIT_CREDITS_SCRIPT,
+        1,
+        KEY,
+        *debit_args(amount, reset_date, next_reset_date),
+    )
+
+
+def test_concurrent_debits_never_overdraw():
+    redis_client = fakeredis.FakeAsyncRedis()
+
+    async def run():
+        await redis_client.hset(
+            KEY, mapping={"total_credits": "10", "used_credits": "0"}
+        )
+        return await asyncio.gather(
+            *[
+                redis_client.eval(DEBIT_CREDITS_SCRIPT, 1, KEY, *debit_args(1))
+                for _ in range(15)
+            ]
+        )
+
+    results = asyncio.run(run())
+    assert sorted(result[0] for result in results) == [0] * 5 + [1] * 10
+    assert sorted(float(result[1]) for result in results if result[0] == 1) == [
+        float(used) for used in range(1, 11)
+    ]
+
+
+def test_insufficient_credits_are_not_debited():
+    redis_client = fakeredis.FakeRedis()
+    store(redis_client, "9")
+    status, used, total, _ = debit(redis_client, 2)
+    assert (status, used, total) == (0, b"9", b"10")
+    assert redis_client.hget(KEY, "used_credits") == b"9"
+
+
+def test_due_reset_clears_usage_before_debit():
+    redis_client = fakeredis.FakeRedis()
+    reset_date = datetime.utcnow() - timedelta(hours=1)
+    next_reset_date = reset_date + timedelta(days=30)
+    store(redis_client, "10", reset_date)
+    status, used, _, reset_at = debit(redis_client, 3, reset_date, next_reset_date)
+    assert (status, float(used)) == (1, 3.0)
+    assert reset_at.decode() == reset_timestamp(next_reset_date)
+    assert redis_client.hget(KEY, "credit_reset_date").decode() == (
+        next_reset_date.isoformat()
+    )
+
+
+def test_legacy_record_resets_from_the_callers_date():
+    redis_client = fakeredis.FakeRedis()
+    reset_date = datetime.utcnow() - timedelta(hours=1)
+    next_reset_date = reset_date + timedelta(days=30)
+    store(redis_client, "10", reset_date, legacy=True)
+    status, used, _, _ = debit(redis_client, 1, reset_date, next_reset_date)
+    assert (status, float(used)) == (1, 1.0)
+    assert redis_client.hget(KEY, "credit_reset_at").decode() == (
+        reset_timestamp(next_reset_date)
+    )
+
+
+def test_stale_reset_date_is_rejected():
+    redis_client = fakeredis.FakeRedis()
+    reset_date = datetime.utcnow() - timedelta(hours=1)
+    store(redis_client, "10", reset_date)
+    stale_date = reset_date - timedelta(days=30)
+    assert debit(redis_client, 1, stale_date, reset_date) == [-2]
+    assert redis_client.hget(KEY, "used_credits") == b"10"
+
+
+def test_unknown_key():
+    assert debit(fakeredis.FakeRedis(), 1) == [-1]
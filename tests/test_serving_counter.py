@@ -0,0 +1,98 @@
+from cortext.validating.managing.serving_counter import ServingCounterRegistry
+import fakeredis
+import pytest
+
+
+@pytest.fixture
+def registry():
+    registry = ServingCounterRegistry(
+        fakeredis.FakeRedis(),
+        mode="fixed_window",
+        partitions={"a": 1.0, "b": 1.0},
+        protected_fraction=0.5,
+    )
+    registry.set_quotas({1: 12})
+    return registry
+
+
+def admitted(registry, partition: str, attempts: int = 20) -> int:
+    return sum(registry.increment(1, 1, partition=partition) for _ in range(attempts))
+
+
+def test_partition_borrows_up_to_protected_share(registry):
+    # a may use its own share of 6 and borrow all but half of b's unused 6
+    assert admitted(registry, "a") == 9
+    # b keeps the protected half of its share
+    assert admitted(registry, "b") == 3
+    assert registry.partition_usage(1) == {"a": 9, "b": 3}
+    assert registry.remaining([1]).tolist() == [0]
+
+
+def test_requests_without_partition_use_the_whole_quota(registry):
+    assert admitted(registry, None) == 12
+
+
+def test_release_refunds_once(registry):
+    assert registry.increment(1, 4, partition="a")
+    registry.reserve("r1", [1], 4, partition="a")
+    assert registry.release("r1") == {1: 4}
+    assert registry.release("r1") == {}
+    assert registry.remaining([1]).tolist() == [12]
+    assert registry.partition_usage(1) == {"a": 0, "b": 0}
+
+
+def test_commit_keeps_the_charge(registry):
+    assert registry.increment(1, 4, partition="b")
+    registry.reserve("r1", [1], 4, partition="b")
+    assert registry.commit("r1") == [1]
+    assert registry.release("r1") == {}
+    assert registry.remaining([1]).tolist() == [8]
+    assert registry.partition_usage(1) == {"a": 0, "b": 4}
+
+
+@pytest.fixture
+def bucket_registry():
+    registry = ServingCounterRegistry(fakeredis.FakeRedis(), mode="token_bucket")
+    registry.set_quotas({1: 12})
+    return registry
+
+
+def rewind(registry, uid: int, seconds: float):
+    """Move the last refill of a bucket into the past."""
+    key = registry.counter_key(uid)
+    ts = float(registry.redis_client.hget(key, "ts"))
+    registry.redis_client.hset(key, "ts", str(ts - seconds))
+
+
+def test_bucket_starts_full_and_refills(bucket_registry):
+    assert admitted(bucket_registry, None) == 12
+    assert bucket_registry.remaining([1]).tolist() == [0]
+    # Interval is 60s, so half of it refills half of the quota
+    rewind(bucket_registry, 1, 30)
+    assert bucket_registry.remaining([1]).tolist() == [6]
+    assert admitted(bucket_registry, None) == 6
+
+
+def test_bucket_refill_is_capped_at_quota(bucket_registry):
+    assert bucket_registry.increment(1, 4)
+    rewind(bucket_registry, 1, 600)
+    assert bucket_registry.remaining([1]).tolist() == [12]
+    assert admitted(bucket_registry, None) == 12
+
+
+def test_bucket_threshold(bucket_registry):
+    # 4 of 12 used is below the threshold, 8 of 12 is not
+    results = [bucket_registry.increment(1, 4, ignore_threshold=0.5) for _ in range(3)]
+    assert results == [True, True, False]
+    assert bucket_registry.remaining([1]).tolist() == [4]
+
+
+def test_bucket_release_is_capped_at_quota(bucket_registry):
+    assert bucket_registry.increment(1, 4)
+    bucket_registry.reserve("r1", [1], 4)
+    # The bucket refilled to almost full while the request was served
+    key = bucket_registry.counter_key(1)
+    bucket_registry.redis_client.hset(key, "tokens", "10")
+    assert bucket_registry.release("r1") == {1: 4}
+    assert float(bucket_registry.redis_client.hget(key, "tokens")) == 12
+    assert bucket_registry.remaining([1]).tolist() == [12]
@@ -0,0 +1,66 @@
+from cortext import CONFIG
+from cortext.validating.managing.miner_manager import MinerManager, TRACKING_GROUP
+import asyncio
+import fakeredis
+import time
+
+
+def make_manager(redis_client) -> MinerManager:
+    manager = object.__new__(MinerManager)
+    manager.redis_client = redis_client
+    manager.posted = []
+
+    async def post_batches(batches):
+        manager.posted.extend(batches)
+        return True
+
+    manager._post_batches = post_batches
+    return manager
+
+
+def add_record(redis_client, batch_id: str, uid: int):
+    redis_client.xadd(
+        CONFIG.redis.tracking_key,
+        {
+            "batch_id": batch_id,
+            "uid": uid,
+            "model": "gpt-4o",
+            "score": 1.0,
+            "response_time": 0.5,
+            "invalid_reason": "",
+            "timestamp": time.time(),
+        },
+    )
+
+
+def pending(redis_client) -> int:
+    return redis_client.xpending(CONFIG.redis.tracking_key, TRACKING_GROUP)["pending"]
+
+
+def test_reports_and_acknowledges():
+    redis_client = fakeredis.FakeRedis()
+    manager = make_manager(redis_client)
+    add_record(redis_client, "a", 1)
+    add_record(redis_client, "a", 2)
+    add_record(redis_client, "b", 3)
+    asyncio.run(manager._report_tracking_data())
+    assert sorted(batch["batch_id"] for batch in manager.posted) == ["a", "b"]
+    assert pending(redis_client) == 0
+
+
+def test_trimmed_pending_entries_do_not_stall_reporting():
+    redis_client = fakeredis.FakeRedis()
+    manager = make_manager(redis_client)
+    add_record(redis_client, "old", 1)
+    add_record(redis_client, "old", 2)
+    # Delivered but never acknowledged, as after a failed upload
+    manager._read_tracking_entries()
+    # The validator's MAXLEN trims them while they are still pending
+    redis_client.xtrim(CONFIG.redis.tracking_key, maxlen=0)
+    add_record(redis_client, "new", 3)
+
+    asyncio.run(manager._report_tracking_data())
+    assert pending(redis_client) == 0
+    asyncio.run(manager._report_tracking_data())
+    assert [batch["batch_id"] for batch in manager.posted] == ["new"]
+    assert pending(redis_client) == 0
@@ -0,0 +1,71 @@
+from cortext.validating.managing.weighted_sampler import FenwickSampler
+import numpy as np
+import random
+import time
+
+
+def test_sample_without_replacement():
+    sampler = FenwickSampler(list(range(16)), [1] * 16)
+    uids = sampler.sample(16, rng=random.Random(0))
+    assert sorted(uids) == list(range(16))
+    assert sampler.total == 16
+
+
+def test_zero_weights_are_never_sampled():
+    sampler = FenwickSampler([10, 11, 12, 13], [0, 5, 0, 3])
+    for seed in range(100):
+        uids = sampler.sample(4, rng=random.Random(seed))
+        assert sorted(uids) == [11, 13]
+
+
+def test_set_updates_total_and_distribution():
+    sampler = FenwickSampler([1, 2, 3], [10, 10, 10])
+    sampler.set(2, 0)
+    sampler.set(3, 30)
+    assert sampler.total == 40
+    assert sampler.weight(2) == 0
+    rng = random.Random(42)
+    counts = {1: 0, 3: 0}
+    for _ in range(4000):
+        counts[sampler.sample(1, rng=rng)[0]] += 1
+    assert 0.7 < counts[3] / 4000 < 0.8
+
+
+def _numpy_consume(uids, remaining_quotas, k):
+    """Selection as done by MinerManager.consume before the Fenwick sampler."""
+    total_remaining = sum(remaining_quotas)
+    probabilities = np.array(remaining_quotas) / total_remaining
+    max_available_uid = len([p for p in probabilities if p > 0])
+    k = min(k, max_available_uid)
+    return np.random.choice(uids, size=k, replace=False, p=probabilities).tolist()
+
+
+def benchmark(n_uids: int, k: int = 4, rounds: int = 2000):
+    uids = list(range(n_uids))
+    remaining_quotas = [random.randint(0, 64) for _ in uids]
+    sampler = FenwickSampler(uids, remaining_quotas)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        selected = _numpy_consume(uids, remaining_quotas, k)
+        for uid in selected:
+            remaining_quotas[uid] = max(0, remaining_quotas[uid] - 1)
+    numpy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        selected = sampler.sample(k)
+        for uid in selected:
+            sampler.set(uid, max(0, sampler.weight(uid) - 1))
+    fenwick_time = time.perf_counter() - start
+
+    print(
+        f"{n_uids} UIDs, k={k}: numpy {numpy_time / rounds * 1e6:.1f}us/batch, "
+        f"fenwick {fenwick_time / rounds * 1e6:.1f}us/batch "
+        f"({numpy_time / fenwick_time:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    for n_uids in [256, 4096]:
+        benchmark(n_uids)